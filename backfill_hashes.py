@@ -0,0 +1,38 @@
+# backfill_hashes.py
+"""
+This file is the backfill job for the perceptual hashes of the PixyProxy system.
+
+Images created before perceptual hashes were stored (see data/scripts/add_phash.sql) have no hash, and are therefore
+invisible to near-duplicate queries and deduplication. This job hashes their files page by page and stores the hashes
+with batched updates. It only touches images without a hash, so it can be stopped and run again at any time.
+
+Usage:
+    python backfill_hashes.py [--images-dir images] [--batch-size 500] [--workers 4]
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import argparse
+import json
+import sys
+
+from data.image_repository import MySQLImageRepository
+from service.similarity_service import SimilarityService, get_similarity_index
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compute the perceptual hashes of images that have none.")
+    parser.add_argument("--images-dir", default="images")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4, help="Threads hashing images.")
+    args = parser.parse_args(argv)
+
+    service = SimilarityService(MySQLImageRepository(), get_similarity_index())
+    stats = service.backfill(images_dir=args.images_dir, batch_size=args.batch_size, workers=args.workers)
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+# bench/__init__.py
+"""
+This package contains the performance tooling of the PixyProxy system.
+
+Author: djjay
+Date: 2024-03-30
+"""
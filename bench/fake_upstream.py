@@ -0,0 +1,122 @@
+# bench/fake_upstream.py
+"""
+This module provides a local fake of the OpenAI images endpoint for benchmarks.
+
+It answers `POST /v1/images/generations` the way the real upstream does (`{"created": ..., "data": [{"b64_json": ...}]}`),
+with configurable latency, image size and error distributions. Latency follows a log-normal distribution around the
+median (a sigma of 0 gives a fixed latency), image sizes vary uniformly by the configured jitter, and a fraction of
+requests fails with the configured status code. All randomness is seeded so runs are reproducible.
+
+Usage:
+    python -m bench.fake_upstream --port 7860 --latency-ms 2000 --latency-sigma 0.3 --error-rate 0.01
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import random
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# PNG file signature, so the payload looks like an image to anything sniffing it
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class FakeUpstreamConfig(BaseModel):
+    latency_ms: float = 50.0
+    latency_sigma: float = 0.0
+    image_bytes: int = 256 * 1024
+    image_bytes_jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    seed: int = 42
+
+
+def make_image(size: int, rng: random.Random) -> bytes:
+    """
+    Makes a fake PNG payload of roughly the given size.
+
+    With Pillow installed this is a decodable PNG of random noise (which barely compresses), so that perceptual
+    hashing runs on it as on a real image; otherwise it is random bytes behind a PNG signature.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        size = max(size, len(PNG_SIGNATURE))
+        return PNG_SIGNATURE + rng.randbytes(size - len(PNG_SIGNATURE))
+
+    side = max(9, int((size / 3) ** 0.5))
+    image = Image.frombytes("RGB", (side, side), rng.randbytes(side * side * 3))
+    output = io.BytesIO()
+    image.save(output, format="PNG", compress_level=1)
+    return output.getvalue()
+
+
+def create_app(config: FakeUpstreamConfig = None) -> FastAPI:
+    """
+    Creates the fake upstream application.
+
+    Parameters:
+    config (FakeUpstreamConfig): The latency, size and error distributions.
+
+    Returns:
+    FastAPI: The fake upstream application.
+    """
+    config = config or FakeUpstreamConfig()
+    rng = random.Random(config.seed)
+
+    # Pre-encode a handful of payloads so the fake does not spend its CPU on base64
+    payloads = []
+    for _ in range(8):
+        jitter = rng.uniform(-config.image_bytes_jitter, config.image_bytes_jitter)
+        payloads.append(base64.b64encode(make_image(int(config.image_bytes * (1 + jitter)), rng)).decode())
+
+    app = FastAPI(title="PixyProxy fake upstream")
+    app.state.config = config
+    app.state.requests = 0
+
+    @app.post("/v1/images/generations")
+    async def generate(body: dict):
+        app.state.requests += 1
+        latency = config.latency_ms * rng.lognormvariate(0, config.latency_sigma) if config.latency_sigma else config.latency_ms
+        await asyncio.sleep(latency / 1000.0)
+
+        if rng.random() < config.error_rate:
+            return JSONResponse(status_code=config.error_status,
+                                content={"error": {"message": "Injected upstream error", "type": "server_error"}})
+
+        return {"created": int(time.time()), "data": [{"b64_json": rng.choice(payloads)}]}
+
+    return app
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI images endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Median upstream latency.")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="Log-normal sigma of the latency (0 = fixed).")
+    parser.add_argument("--image-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--image-bytes-jitter", type=float, default=0.0, help="Relative size variation, e.g. 0.5.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    config = FakeUpstreamConfig(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                                image_bytes=args.image_bytes, image_bytes_jitter=args.image_bytes_jitter,
+                                error_rate=args.error_rate, error_status=args.error_status, seed=args.seed)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
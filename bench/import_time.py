@@ -0,0 +1,103 @@
+# bench/import_time.py
+"""
+This module measures the cold-start import cost of the PixyProxy application.
+
+Each run imports the target module in a fresh interpreter with `python -X importtime`, so nothing is cached in
+`sys.modules`. The median cumulative import time, the slowest modules and the presence of modules that must stay
+lazy (the openai SDK, the MySQL connector) are reported as JSON. With --budget-ms the exit code is 1 when the median
+exceeds the budget or when a lazy module was imported, which makes it usable as a regression check in CI.
+
+Usage:
+    python -m bench.import_time --runs 5 --budget-ms 1500
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# Modules that must not be imported by `import main`; they are loaded on first use or in the app lifespan
+LAZY_MODULES = ("openai", "mysql.connector")
+
+
+def measure_import(module: str = "main") -> Dict:
+    """
+    Imports a module in a fresh interpreter and collects its import timings.
+
+    Parameters:
+    module (str): The module to import.
+
+    Returns:
+    Dict: The cumulative import time of the module in ms, the per-module timings in ms and the loaded lazy modules.
+    """
+    check = f"import sys; import {module}; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", check],
+                            capture_output=True, text=True, check=True)
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        timings[name.strip()] = int(cumulative) / 1000.0
+
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    return {"total_ms": timings.get(module, 0.0), "modules_ms": timings, "lazy_modules_loaded": loaded}
+
+
+def run(module: str = "main", runs: int = 5, top: int = 10) -> Dict:
+    """
+    Measures the cold-start import cost of a module over several runs.
+
+    Parameters:
+    module (str): The module to import.
+    runs (int): The number of fresh interpreters to measure.
+    top (int): The number of slowest modules to report.
+
+    Returns:
+    Dict: The median, min and max import time in ms, the slowest modules of the median run and the loaded lazy modules.
+    """
+    samples: List[Dict] = sorted((measure_import(module) for _ in range(runs)), key=lambda s: s["total_ms"])
+    median = samples[len(samples) // 2]
+    slowest = sorted(median["modules_ms"].items(), key=lambda item: item[1], reverse=True)
+    return {
+        "module": module,
+        "runs": runs,
+        "median_ms": round(statistics.median(s["total_ms"] for s in samples), 2),
+        "min_ms": round(samples[0]["total_ms"], 2),
+        "max_ms": round(samples[-1]["total_ms"], 2),
+        "slowest_modules_ms": {name: round(ms, 2) for name, ms in slowest[:top] if name != module},
+        "lazy_modules_loaded": sorted({m for s in samples for m in s["lazy_modules_loaded"]}),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the cold-start import cost of the PixyProxy app.")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="Fail when the median import time exceeds this budget.")
+    args = parser.parse_args(argv)
+
+    report = run(args.module, args.runs, args.top)
+    print(json.dumps(report, indent=2))
+
+    if report["lazy_modules_loaded"]:
+        print(f"Lazy modules imported at startup: {', '.join(report['lazy_modules_loaded'])}", file=sys.stderr)
+        return 1
+    if args.budget_ms is not None and report["median_ms"] > args.budget_ms:
+        print(f"Median import time {report['median_ms']}ms exceeds the budget of {args.budget_ms}ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
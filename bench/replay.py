@@ -0,0 +1,176 @@
+# bench/replay.py
+"""
+This module replays captured PixyProxy traffic against a target instance.
+
+It streams one or more capture files written by the LoggingMiddleware (see web/request_capture.py), merged by
+timestamp, and issues every request at its original offset divided by --speed (2 replays twice as fast, 10 ten times
+as fast). At most --concurrency requests are in flight; when the target cannot keep up, requests start late and the
+schedule lag is reported.
+
+Captured GUIDs (possibly anonymized) are mapped onto the GUIDs that exist on the target with a stable hash, so the same
+captured image always hits the same target image. Captured image generations are replayed with a synthetic prompt.
+
+The report holds the latency distribution per route and the status codes that diverge from the capture.
+
+Usage:
+    python -m bench.replay capture.jsonl --target http://localhost:8001 --speed 10 --concurrency 64
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import argparse
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import httpx
+
+from bench.stats import summarize
+
+REPLAY_PROMPT = "a rubber duck on a sink"
+
+
+def read_capture(path: str) -> Iterator[Dict]:
+    """
+    Streams the records of a capture file.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def merge_captures(paths: Sequence[str]) -> Iterator[Dict]:
+    """
+    Streams the records of several capture files (e.g. one per worker) in timestamp order.
+    """
+    return heapq.merge(*(read_capture(path) for path in paths), key=lambda record: record["ts"])
+
+
+def map_guid(guid: str, target_guids: Sequence[str]) -> str:
+    """
+    Maps a captured GUID onto a GUID that exists on the target, stably.
+    """
+    if not target_guids:
+        return guid
+    index = int(hashlib.sha256(guid.encode()).hexdigest()[:8], 16) % len(target_guids)
+    return target_guids[index]
+
+
+def build_request(record: Dict, target_guids: Sequence[str]):
+    """
+    Builds the (method, path, json) request that replays a captured record.
+    """
+    route = record.get("route")
+    path = record["path"]
+    guid = record.get("guid")
+    if guid is not None:
+        target_guid = map_guid(guid, target_guids)
+        path = route.replace("{guid}", target_guid) if route else path.replace(guid, target_guid)
+    body = {"prompt": REPLAY_PROMPT} if record["method"] == "POST" else None
+    return record["method"], path, body
+
+
+async def replay(records: Iterable[Dict], target: str, speed: float = 1.0, concurrency: int = 32,
+                 max_requests: Optional[int] = None, timeout: float = 120.0) -> Dict:
+    """
+    Replays captured records against a target.
+
+    Parameters:
+    records (Iterable[Dict]): The captured records, in timestamp order.
+    target (str): The base URL of the target.
+    speed (float): The replay speed relative to the capture.
+    concurrency (int): The maximum number of requests in flight.
+    max_requests (Optional[int]): Stop after this many requests.
+    timeout (float): The timeout of a single request in seconds.
+
+    Returns:
+    Dict: The summary per route, the status divergence per route and the schedule lag.
+    """
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    divergence: Dict[str, Counter] = defaultdict(Counter)
+    max_lag_ms = 0.0
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=target, timeout=timeout, limits=limits) as client:
+        target_guids = [image["guid"] for image in (await client.get("/image/")).raise_for_status().json()]
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def issue(record: Dict):
+            route = f"{record['method']} {record.get('route') or record['path']}"
+            method, path, body = build_request(record, target_guids)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                await response.aread()
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            finally:
+                semaphore.release()
+            latencies[route].append((time.perf_counter() - start) * 1000.0)
+            statuses[route][status] += 1
+            if record.get("status") is not None and status != record["status"]:
+                divergence[route][f"{record['status']}->{status}"] += 1
+
+        started = time.perf_counter()
+        first_ts = None
+        for record in itertools.islice(records, max_requests):
+            first_ts = record["ts"] if first_ts is None else first_ts
+            due = started + (record["ts"] - first_ts) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await semaphore.acquire()
+            max_lag_ms = max(max_lag_ms, (time.perf_counter() - due) * 1000.0)
+            task = asyncio.create_task(issue(record))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    return {
+        "target": target,
+        "speed": speed,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "max_schedule_lag_ms": round(max_lag_ms, 3),
+        "routes": {route: summarize(values, elapsed, statuses[route]) for route, values in latencies.items()},
+        "status_divergence": {route: dict(counts) for route, counts in divergence.items()},
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay captured PixyProxy traffic against a target.")
+    parser.add_argument("captures", nargs="+", help="Capture JSONL files, merged by timestamp.")
+    parser.add_argument("--target", default="http://localhost:8001")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, e.g. 2 or 10.")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-requests", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(replay(merge_captures(args.captures), args.target, args.speed, args.concurrency,
+                                args.max_requests))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+# bench/run.py
+"""
+This module runs the reproducible benchmark suite of the PixyProxy system.
+
+By default the app is served in-process with an InMemoryImageRepository and a local fake upstream (see
+bench/fake_upstream.py), so no MySQL and no network access are needed. With --target an already running instance is
+benchmarked instead. Each workload (see bench/workloads.py) is driven with bounded async concurrency, and the
+throughput and p50/p95/p99 latencies are written as JSON. With --baseline the results are compared against a stored
+run and the exit code is 1 when a workload regressed by more than the tolerance.
+
+Usage:
+    python -m bench.run --workloads lookup,content,mixed --requests 1000 --concurrency 16 --output results.json
+    python -m bench.run --baseline bench_baseline.json --tolerance 0.15
+    python -m bench.run --save-baseline bench_baseline.json
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Sequence
+
+import httpx
+
+from bench import fake_upstream
+from bench.stats import summarize
+from bench.workloads import WORKLOADS, Request, build_requests
+
+
+def start_server(app, host: str = "127.0.0.1", port: int = 0):
+    """
+    Serves an ASGI app with uvicorn on a background thread.
+
+    Returns:
+    Tuple[uvicorn.Server, str]: The server (set `should_exit` to stop it) and its base URL.
+    """
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The benchmark server failed to start.")
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    server.thread = thread
+    return server, f"http://{host}:{port}"
+
+
+def stop_server(server):
+    server.should_exit = True
+    server.thread.join()
+
+
+@contextmanager
+def _environ(**values):
+    # Sets environment variables for the duration of the context and restores their previous values
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@contextmanager
+def local_target(seed_images: int, upstream: fake_upstream.FakeUpstreamConfig):
+    """
+    Serves the app in-process with an InMemoryImageRepository and a fake upstream, in a temporary working directory.
+
+    Yields:
+    Tuple[str, List[str]]: The base URL of the app and the GUIDs of the seeded images.
+    """
+    from core import make_guid
+    from core.image_generator import ImageGenerator
+    from data.database_context import NullDatabaseContext
+    from data.image_repository import InMemoryImageRepository
+    from main import app
+    from service.image_service import ImageService
+    from web.dependencies import get_image_repository, get_image_service
+
+    cwd = os.getcwd()
+    environ = _environ(WARMUP_ON_STARTUP='false', DB_CHECK_ON_STARTUP='false')
+    with environ, tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.makedirs('images')
+        upstream_server, upstream_url = start_server(fake_upstream.create_app(upstream))
+        try:
+            repo = InMemoryImageRepository()
+            rng = random.Random(upstream.seed)
+            guids = []
+            for i in range(seed_images):
+                filename = f"seed_{i}.png"
+                with open(os.path.join('images', filename), 'wb') as f:
+                    f.write(fake_upstream.make_image(upstream.image_bytes, rng))
+                guids.append(repo.create_image(f"seed image {i}", make_guid(), filename).guid)
+
+            generator = ImageGenerator(repo, base_url=f"{upstream_url}/v1", api_key="bench")
+            service = ImageService(repo, generator, db_context=NullDatabaseContext)
+            app.dependency_overrides[get_image_repository] = lambda: repo
+            app.dependency_overrides[get_image_service] = lambda: service
+
+            app_server, app_url = start_server(app)
+            try:
+                yield app_url, guids
+            finally:
+                stop_server(app_server)
+                app.dependency_overrides.clear()
+        finally:
+            stop_server(upstream_server)
+            os.chdir(cwd)
+
+
+async def run_requests(base_url: str, requests: Sequence[Request], concurrency: int, timeout: float = 120.0) -> Dict:
+    """
+    Issues requests against a target with bounded concurrency.
+
+    Parameters:
+    base_url (str): The base URL of the target.
+    requests (Sequence[Request]): The (method, path, json) requests to issue.
+    concurrency (int): The maximum number of requests in flight.
+    timeout (float): The timeout of a single request in seconds.
+
+    Returns:
+    Dict: The summary of the run, see bench.stats.summarize.
+    """
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    pending = iter(requests)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            for method, path, body in pending:
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body)
+                    await response.aread()
+                    statuses[response.status_code] += 1
+                except httpx.HTTPError:
+                    statuses[0] += 1
+                latencies.append((time.perf_counter() - start) * 1000.0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return summarize(latencies, elapsed, statuses)
+
+
+def seed_remote(base_url: str, seed_images: int) -> List[str]:
+    """
+    Gets the GUIDs of the images of a running instance, generating images when it has none.
+    """
+    with httpx.Client(base_url=base_url, timeout=120.0) as client:
+        guids = [image["guid"] for image in client.get("/image/").raise_for_status().json()]
+        for _ in range(max(0, seed_images - len(guids)) if not guids else 0):
+            response = client.post("/image/", json={"prompt": f"benchmark seed {uuid.uuid4().hex[:8]}"})
+            guids.append(response.raise_for_status().json()["guid"])
+    return guids
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Compares benchmark results against a baseline.
+
+    Parameters:
+    results (Dict): The results of this run.
+    baseline (Dict): The results of the baseline run.
+    tolerance (float): The allowed relative regression, e.g. 0.15 for 15%.
+
+    Returns:
+    List[str]: A description of every regression; empty when there are none.
+    """
+    regressions = []
+    for name, current in results["workloads"].items():
+        previous = baseline.get("workloads", {}).get(name)
+        if previous is None:
+            continue
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput_rps']} rps < baseline {previous['throughput_rps']} rps")
+        for key in ("p95_ms", "p99_ms"):
+            if previous[key] and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {current[key]} > baseline {previous[key]}")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors > baseline {previous['errors']}")
+    return regressions
+
+
+def run(workloads: Sequence[str], requests: int, concurrency: int, seed: int = 42, seed_images: int = 100,
+        target: str = None, upstream: fake_upstream.FakeUpstreamConfig = None) -> Dict:
+    """
+    Runs the benchmark workloads.
+
+    Returns:
+    Dict: The configuration of the run and the summary of every workload.
+    """
+    upstream = upstream or fake_upstream.FakeUpstreamConfig(seed=seed)
+    results = {
+        "meta": {"target": target or "local", "requests": requests, "concurrency": concurrency, "seed": seed,
+                 "seed_images": seed_images, "upstream": upstream.model_dump() if target is None else None},
+        "workloads": {},
+    }
+
+    def run_all(base_url: str, guids: Sequence[str]):
+        for name in workloads:
+            planned = build_requests(name, requests, guids, seed)
+            results["workloads"][name] = asyncio.run(run_requests(base_url, planned, concurrency))
+
+    if target:
+        run_all(target, seed_remote(target, seed_images))
+    else:
+        with local_target(seed_images, upstream) as (base_url, guids):
+            run_all(base_url, guids)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the PixyProxy benchmark suite.")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS),
+                        help=f"Comma separated workloads out of {', '.join(WORKLOADS)}.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per workload.")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--seed-images", type=int, default=100)
+    parser.add_argument("--target", default=None, help="Benchmark a running instance instead of an in-process one.")
+    parser.add_argument("--upstream-latency-ms", type=float, default=50.0)
+    parser.add_argument("--upstream-latency-sigma", type=float, default=0.0)
+    parser.add_argument("--upstream-image-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", default=None, help="Compare the results against this stored run.")
+    parser.add_argument("--save-baseline", default=None, help="Store the results as a baseline in this file.")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    upstream = fake_upstream.FakeUpstreamConfig(latency_ms=args.upstream_latency_ms,
+                                                latency_sigma=args.upstream_latency_sigma,
+                                                image_bytes=args.upstream_image_bytes,
+                                                error_rate=args.upstream_error_rate, seed=args.seed)
+    results = run([w.strip() for w in args.workloads.split(",") if w.strip()], args.requests, args.concurrency,
+                  args.seed, args.seed_images, args.target, upstream)
+
+    output = json.dumps(results, indent=2)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                f.write(output)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
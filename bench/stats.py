@@ -0,0 +1,57 @@
+# bench/stats.py
+"""
+This module contains the statistics helpers shared by the benchmark and replay tools.
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """
+    Gets a percentile with the nearest-rank method.
+
+    Parameters:
+    sorted_values (Sequence[float]): The values, sorted ascending.
+    pct (float): The percentile, between 0 and 100.
+
+    Returns:
+    float: The percentile, or 0.0 for no values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies_ms: Iterable[float], elapsed_s: float, statuses: Counter) -> Dict:
+    """
+    Summarizes the latencies and status codes of a run.
+
+    Parameters:
+    latencies_ms (Iterable[float]): The latency of every request in ms.
+    elapsed_s (float): The wall clock duration of the run in seconds.
+    statuses (Counter): The number of responses per status code (0 for transport errors).
+
+    Returns:
+    Dict: The request and error counts, the throughput and the latency distribution.
+    """
+    values: List[float] = sorted(latencies_ms)
+    errors = sum(count for status, count in statuses.items() if status == 0 or status >= 500)
+    summary = {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed_s, 2) if elapsed_s > 0 else 0.0,
+        "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+        "max_ms": round(values[-1], 3) if values else 0.0,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+    for pct in PERCENTILES:
+        summary[f"p{pct}_ms"] = round(percentile(values, pct), 3)
+    return summary
@@ -0,0 +1,69 @@
+# bench/workloads.py
+"""
+This module defines the scripted benchmark workloads of the PixyProxy system.
+
+A workload is a weighted list of request kinds. Each kind builds a (method, path, json) request from a seeded random
+generator and the GUIDs of the images that exist on the target, so every run issues the same request sequence.
+
+- lookup: point lookups of image details by GUID
+- list: listing of all image details
+- content: download of image content by GUID
+- generate: a burst of image generations
+- mixed: a read-heavy mix of all of the above
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import random
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+Request = Tuple[str, str, Optional[dict]]
+
+PROMPTS = ("a rubber duck on a sink", "create a baseball image", "a lighthouse at dusk",
+           "a cat wearing a top hat", "a bowl of ramen in watercolor")
+
+
+def lookup(rng: random.Random, guids: Sequence[str]) -> Request:
+    return "GET", f"/image/{rng.choice(guids)}", None
+
+
+def listing(rng: random.Random, guids: Sequence[str]) -> Request:
+    return "GET", "/image/", None
+
+
+def content(rng: random.Random, guids: Sequence[str]) -> Request:
+    return "GET", f"/image/{rng.choice(guids)}/content", None
+
+
+def generate(rng: random.Random, guids: Sequence[str]) -> Request:
+    return "POST", "/image/", {"prompt": rng.choice(PROMPTS)}
+
+
+WORKLOADS: Dict[str, List[Tuple[float, Callable[[random.Random, Sequence[str]], Request]]]] = {
+    "lookup": [(1.0, lookup)],
+    "list": [(1.0, listing)],
+    "content": [(1.0, content)],
+    "generate": [(1.0, generate)],
+    "mixed": [(0.6, lookup), (0.2, content), (0.15, listing), (0.05, generate)],
+}
+
+
+def build_requests(workload: str, count: int, guids: Sequence[str], seed: int = 42) -> List[Request]:
+    """
+    Builds the request sequence of a workload.
+
+    Parameters:
+    workload (str): The name of the workload.
+    count (int): The number of requests.
+    guids (Sequence[str]): The GUIDs of the images that exist on the target.
+    seed (int): The seed of the random generator.
+
+    Returns:
+    List[Request]: The requests as (method, path, json) tuples.
+    """
+    if workload not in WORKLOADS:
+        raise ValueError(f"Unknown workload '{workload}', expected one of {', '.join(WORKLOADS)}")
+    rng = random.Random(seed)
+    weights, kinds = zip(*WORKLOADS[workload])
+    return [rng.choices(kinds, weights)[0](rng, guids) for _ in range(count)]
@@ -22,8 +22,8 @@ class RecordNotFoundError(ImageException):
         super().__init__("The requested record was not found.")
 
 class ImageNotFoundError(ImageException):
-    def __init__(self):
-        super().__init__("The requested image was not found.")
+    def __init__(self, message: str = "The requested image was not found."):
+        super().__init__(message)
 
 class ConstraintViolationError(ImageException):
     def __init__(self):
@@ -38,6 +38,10 @@ class InvalidOperationError(ImageException):
     def __init__(self, message: str):
         super().__init__(message)
 
+class TooManyRequestsError(ImageException):
+    def __init__(self, message: str = "Too many requests"):
+        super().__init__(message)
+
 # Web layer exceptions
 class BadRequestError(ImageException):
     def __init__(self, message: str = "Bad request"):
@@ -56,6 +60,7 @@ EXCEPTION_STATUS_CODES = {
     ConstraintViolationError: 409,  # Conflict
     DataValidationError: 400,  # Bad Request
     InvalidOperationError: 400,  # Bad Request
+    TooManyRequestsError: 429,  # Too Many Requests
     BadRequestError: 400,  # Bad Request
     EndPointNotFoundError: 404,  # Not Found
     InvalidOperationError: 403,  # Forbidden
@@ -6,6 +6,10 @@ Author: djjay
 Date: 2024-03-20
 """
 class ImageColumns:
+    ID = 'id'
     GUID = 'guid'
     FILENAME = 'filename'
-    PROMPT = 'prompt'
\ No newline at end of file
+    PROMPT = 'prompt'
+    PHASH = 'phash'
+    CREATED_AT = 'created_at'
+    UPDATED_AT = 'updated_at'
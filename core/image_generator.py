@@ -1,30 +1,58 @@
 import os
 
-from typing import Literal
-from openai import OpenAI
+from functools import lru_cache
+from typing import Callable, Literal, Optional
 
 import core
 from .models import ImageDetail, ImageDetailCreate
+from .similarity_index import dhash
+from data.image_cache import get_image_cache
 from data.image_repository import ImageRepositoryInterface
-import httpx
+from service import logger
 import time
 import base64
-import json
+
+DEFAULT_BASE_URL = 'http://aitools.cs.vt.edu:7860/openai/v1'
+DEFAULT_API_KEY = 'aitools'
+
+@lru_cache(maxsize=None)
+def get_openai_client(base_url: str = DEFAULT_BASE_URL, api_key: str = DEFAULT_API_KEY):
+    """
+    Gets the shared OpenAI client for a base URL and API key.
+
+    The openai SDK is only imported on first use, and the client (with its HTTP connection pool)
+    is reused across requests instead of being rebuilt for every ImageGenerator.
+    """
+    from openai import OpenAI
+
+    return OpenAI(base_url=base_url, api_key=api_key)
 
 class ImageGenerator:
-    def __init__(self, repository: ImageRepositoryInterface, base_url='http://aitools.cs.vt.edu:7860/openai/v1',
-                 api_key='aitools'):
-        self.client = OpenAI(base_url=base_url, api_key=api_key)
+    def __init__(self, repository: ImageRepositoryInterface, base_url=DEFAULT_BASE_URL,
+                 api_key=DEFAULT_API_KEY, similarity_service=None, dedup_max_distance: int = None):
+        self.base_url = base_url
+        self.api_key = api_key
         self.repo = repository
+        # With a dedup distance, a near-duplicate of an existing image is not stored; the existing image is returned
+        self.similarity_service = similarity_service
+        self.dedup_max_distance = dedup_max_distance
 
         # Ensure the images directory exists
         if not os.path.exists('images'):
             os.makedirs('images')        
 
+    @property
+    def client(self):
+        return get_openai_client(self.base_url, self.api_key)
+
     def generate_image(self, image_create_request: ImageDetailCreate, model: str = "dall-e-3",
                    style: Literal["vivid", "natural"] = "vivid",
                    quality: Literal["standard", "hd"] = "hd",
-                   size: Literal["256x256", "512x512", "1024x1024", "1792x1024", "1024x1792"] = "1024x1024") -> ImageDetail:
+                   size: Literal["256x256", "512x512", "1024x1024", "1792x1024", "1024x1792"] = "1024x1024",
+                   progress: Optional[Callable[..., None]] = None) -> ImageDetail:
+        # progress, if given, is called with the name of every completed step and its data
+        progress = progress or (lambda event, **data: None)
+
         # Call OpenAI
         response = self.client.images.generate(prompt=image_create_request.prompt, 
                                             model=model,
@@ -38,6 +66,19 @@ class ImageGenerator:
 
         # Decode the base64 data to get the image content
         image_content = base64.b64decode(image_data_b64)
+        progress("upstream-complete", bytes=len(image_content))
+
+        # Compute the perceptual hash for near-duplicate detection
+        try:
+            phash = dhash(image_content)
+        except Exception as e:
+            logger.warning(f"Could not compute the perceptual hash of a generated image: {e}")
+            phash = None
+
+        if phash is not None and self.similarity_service is not None and self.dedup_max_distance is not None:
+            duplicate_guid = self.similarity_service.find_duplicate(phash, self.dedup_max_distance)
+            if duplicate_guid is not None:
+                return self.repo.get_image_details_by_guid(duplicate_guid)
 
         # Generate a filename and a GUID
         timestamp = int(time.time())
@@ -48,8 +89,12 @@ class ImageGenerator:
         with open(os.path.join('images', filename), 'wb') as f:
             f.write(image_content)
 
-        # Using self.repo, save the guid, filename and prompt to the database
-        image_detail = self.repo.create_image(image_create_request.prompt, guid, filename)
+        # Recently generated images are the most requested ones, so pre-populate the content cache
+        get_image_cache().put(filename, image_content, force=True)
+
+        # Using self.repo, save the guid, filename, prompt and hash to the database
+        image_detail = self.repo.create_image(image_create_request.prompt, guid, filename, phash)
+        progress("stored", guid=guid)
 
         # Return the ImageDetail object
         return image_detail
\ No newline at end of file
@@ -6,6 +6,10 @@ The `ImageDetailCreate` model represents the data needed to create a new image,
 
 The `ImageDetail` model extends `ImageDetailCreate` and includes additional fields that are set by the system when an image is created, such as the unique ID, GUID, and timestamp.
 
+The `ImageRecord` model extends `ImageDetail` with the internal ID and the creation and update timestamps, as needed for keyset iteration and bulk export and import, and the perceptual hash used for near-duplicate detection.
+
+The `SimilarImage` model extends `ImageDetail` with the Hamming distance between its perceptual hash and that of the image it was compared to.
+
 Author: djjay
 Date: 2024-03-20
 """
@@ -19,4 +23,13 @@ class ImageDetailCreate(BaseModel):
 
 class ImageDetail(ImageDetailCreate):
     guid: str
-    filename: str
\ No newline at end of file
+    filename: str
+
+class ImageRecord(ImageDetail):
+    id: int
+    phash: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class SimilarImage(ImageDetail):
+    distance: int
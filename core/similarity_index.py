@@ -0,0 +1,144 @@
+# core/similarity_index.py
+"""
+This module implements near-duplicate image detection for the PixyProxy system.
+
+`dhash` computes a 64-bit difference hash of an image: the image is reduced to a 9x8 grayscale thumbnail and every bit
+records whether a pixel is brighter than its right neighbour. Near-identical images have hashes that differ in only a
+few bits, so the Hamming distance between two hashes measures how similar the images are.
+
+The `SimilarityIndex` keeps the hashes of all images packed in a NumPy uint64 array next to a fixed-width array of
+their GUIDs. A query XORs the query hash against the whole array and counts the differing bits in one vectorized pass,
+which answers "similar to {guid}" over millions of images in milliseconds. The arrays grow by doubling, so adding an
+image is amortized O(1).
+
+NumPy and Pillow are imported on first use, to keep them out of the cold start of the app.
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import io
+import threading
+from typing import List, Optional, Tuple
+
+HASH_SIZE = 8
+GUID_WIDTH = 32
+
+
+def dhash(image_content: bytes) -> int:
+    """
+    Computes the 64-bit difference hash of an image.
+
+    Parameters:
+    image_content (bytes): The encoded image, e.g. a PNG.
+
+    Returns:
+    int: The hash, as an unsigned 64-bit integer.
+    """
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_content)) as image:
+        pixels = np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def _popcount(values):
+    import numpy as np
+
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    # NumPy < 2.0: count the bits byte by byte with a lookup table
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+class SimilarityIndex:
+    def __init__(self, capacity: int = 1024):
+        import numpy as np
+
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._guids = np.zeros(capacity, dtype=f'S{GUID_WIDTH}')
+        self._size = 0
+        self._lock = threading.Lock()
+        self.last_id = 0  # The last database ID loaded into the index
+        self.last_refresh = None  # When the index was last brought up to date with the database
+        self.last_updated_at = None  # The latest update time of the images reconciled with the database
+        self.last_reconcile = None  # When hashes set on already loaded images were last picked up
+        self.refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, guid: str, image_hash: int):
+        import numpy as np
+
+        with self._lock:
+            if self._size == len(self._hashes):
+                self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+                self._guids = np.concatenate([self._guids, np.zeros_like(self._guids)])
+            self._hashes[self._size] = image_hash
+            self._guids[self._size] = guid.encode()
+            self._size += 1
+
+    def add_missing(self, entries: List[Tuple[str, int]]) -> int:
+        """
+        Adds the images that are not in the index yet.
+
+        Parameters:
+        entries (List[Tuple[str, int]]): The GUIDs and hashes of the images.
+
+        Returns:
+        int: The number of images added.
+        """
+        import numpy as np
+
+        if not entries:
+            return 0
+        _, guids = self._snapshot()
+        known = np.isin(np.array([guid.encode() for guid, _ in entries], dtype=f'S{GUID_WIDTH}'), guids)
+        added = 0
+        for (guid, image_hash), is_known in zip(entries, known):
+            if not is_known:
+                self.add(guid, image_hash)
+                added += 1
+        return added
+
+    def _snapshot(self):
+        # Entries are only ever appended, so views of the filled part stay valid without the lock
+        with self._lock:
+            return self._hashes[:self._size], self._guids[:self._size]
+
+    def get_hash(self, guid: str) -> Optional[int]:
+        import numpy as np
+
+        hashes, guids = self._snapshot()
+        rows = np.flatnonzero(guids == guid.encode())
+        return int(hashes[rows[0]]) if len(rows) else None
+
+    def query(self, image_hash: int, max_distance: int = 10, limit: int = 20,
+              exclude_guid: str = None) -> List[Tuple[str, int]]:
+        """
+        Finds the images whose hash is within a Hamming distance of a hash.
+
+        Parameters:
+        image_hash (int): The hash to compare against.
+        max_distance (int): The maximum number of differing bits, out of 64.
+        limit (int): The maximum number of matches to return.
+        exclude_guid (str): A GUID to leave out of the matches, usually the image the query is for.
+
+        Returns:
+        List[Tuple[str, int]]: The GUIDs and distances of the matches, closest first.
+        """
+        import numpy as np
+
+        hashes, guids = self._snapshot()
+        distances = _popcount(np.bitwise_xor(hashes, np.uint64(image_hash)))
+        rows = np.flatnonzero(distances <= max_distance)
+        if exclude_guid is not None:
+            rows = rows[guids[rows] != exclude_guid.encode()]
+        if len(rows) > limit:
+            rows = rows[np.argpartition(distances[rows], limit - 1)[:limit]]
+        rows = rows[np.argsort(distances[rows], kind="stable")]
+        return [(guids[row].decode(), int(distances[row])) for row in rows]
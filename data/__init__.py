@@ -1,10 +1,10 @@
 # data/__init__.py
 """
-This module initializes the data layer of the PixyProxy system. 
+This module initializes the data layer of the PixyProxy system.
 
-It loads environment variables from a .env file, retrieves the database connection string, and creates a DbContext instance that will be used throughout the data layer to interact with the database.
+It loads environment variables from a .env file, retrieves the database configuration, and provides the connection pool that is used by the DbContext throughout the data layer to interact with the database.
 
-The DbContext instance is created with the connection string and is responsible for managing database connections and transactions.
+Nothing is loaded or connected at import time: the .env file is read and the pool is created on first use (or during the app lifespan warm-up), so importing the data layer stays cheap and does not fail when MySQL is down.
 
 Author: djjay
 Date: 2024-03-20
@@ -12,26 +12,151 @@ Date: 2024-03-20
 
 import os
 import threading
-from dotenv import load_dotenv
-from mysql.connector import pooling
-
-load_dotenv()
-
-# Database Configuration
-config = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT'),
-    'database': os.getenv('DB_NAME'),
-    'raise_on_warnings': True,
-}
+from core.exceptions import DBConnectionError
 
 # Create a thread-local storage
 local_storage = threading.local()
 
-db_pool = pooling.MySQLConnectionPool(pool_name="pool", pool_size=10, **config)
+_init_lock = threading.Lock()
+_config = None
+_db_pool = None
+_replica_router = None
+_replica_router_ready = False
+
+# mysql-connector refuses pools larger than this (mysql.connector.pooling.CNX_POOL_MAXSIZE)
+MAX_POOL_SIZE = 32
+
+
+def get_config() -> dict:
+    """
+    Gets the database configuration, loading the .env file on first use.
+
+    Returns:
+    dict: The connection arguments for the MySQL connector.
+    """
+    global _config
+    if _config is None:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _config = {
+            'user': os.getenv('DB_USER'),
+            'password': os.getenv('DB_PASSWORD'),
+            'host': os.getenv('DB_HOST'),
+            'port': os.getenv('DB_PORT'),
+            'database': os.getenv('DB_NAME'),
+            'raise_on_warnings': True,
+        }
+    return _config
+
+
+def get_pool_size() -> int:
+    """
+    Gets the pool size of this process.
+
+    The pool size is set per worker process; the launcher (serve.py) divides the
+    total connection budget across workers and exports the result as DB_POOL_SIZE.
+
+    Raises:
+    ValueError: If DB_POOL_SIZE is outside of what mysql-connector accepts (1 to 32).
+    """
+    get_config()
+    pool_size = int(os.getenv('DB_POOL_SIZE', 10))
+    if not 1 <= pool_size <= MAX_POOL_SIZE:
+        raise ValueError(f"DB_POOL_SIZE must be between 1 and {MAX_POOL_SIZE}, got {pool_size}.")
+    return pool_size
+
+
+def get_db_pool():
+    """
+    Gets the connection pool, creating it on first use.
+
+    Returns:
+    MySQLConnectionPool: The connection pool of this process.
+
+    Raises:
+    DBConnectionError: If the pool could not be established.
+    """
+    if _db_pool is None:
+        with _init_lock:
+            _get_primary_pool()
+    return _db_pool
+
+
+def _get_primary_pool():
+    # Must be called with _init_lock held
+    global _db_pool
+    if _db_pool is None:
+        from mysql.connector import Error, pooling
+
+        try:
+            _db_pool = pooling.MySQLConnectionPool(pool_name="pool", pool_size=get_pool_size(), **get_config())
+        except Error as e:
+            raise DBConnectionError() from e
+    return _db_pool
+
+
+def get_replica_router():
+    """
+    Gets the router between the primary and the read replicas, creating it on first use.
+
+    Returns:
+    Optional[ReplicaRouter]: The router, or None when no replicas are configured in DB_REPLICA_HOSTS.
+    """
+    global _replica_router, _replica_router_ready
+    if not _replica_router_ready:
+        with _init_lock:
+            if not _replica_router_ready:
+                get_config()
+                hosts = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+                if hosts:
+                    _replica_router = _create_replica_router(hosts)
+                _replica_router_ready = True
+    return _replica_router
+
+
+def _create_replica_router(hosts):
+    from mysql.connector import Error, pooling
+    from data.replica_router import ReplicaRouter
+    from service import logger
+
+    replica_pools = {}
+    for index, host in enumerate(hosts):
+        name, _, port = host.partition(':')
+        replica_config = {**get_config(), 'host': name, 'port': port or get_config()['port']}
+        try:
+            replica_pools[host] = pooling.MySQLConnectionPool(pool_name=f"replica{index}", pool_size=get_pool_size(),
+                                                              **replica_config)
+        except Error as e:
+            # A missing replica only costs read capacity; its reads go to the primary
+            logger.warning(f"Replica {host} is unavailable and will not be used: {e}")
+
+    router = ReplicaRouter(_get_primary_pool(), replica_pools,
+                           max_lag_seconds=float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', 5)),
+                           sticky_seconds=float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', 5)),
+                           health_interval=float(os.getenv('DB_REPLICA_HEALTH_INTERVAL', 2)))
+    router.start()
+    return router
+
 
 # Provide a global function to fetch the current context
 def get_current_db_context():
     return getattr(local_storage, "db_context", None)
+
+def check_db_pool():
+    """
+    Verifies that a connection can be taken from the pool and that the server answers a ping.
+
+    Raises:
+    DBConnectionError: If no working connection could be obtained.
+    """
+    from mysql.connector import Error
+
+    try:
+        conn = get_db_pool().get_connection()
+        try:
+            conn.ping(reconnect=False)
+        finally:
+            conn.close()
+    except Error as e:
+        raise DBConnectionError() from e
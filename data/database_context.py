@@ -10,14 +10,23 @@ Author: djjay
 Date: 2024-03-20
 """
 # data/db_context.py
-from data import local_storage, db_pool
+from typing import Optional
+from data import local_storage, get_db_pool, get_replica_router
 
 class DatabaseContext:
-    def __init__(self):
+    def __init__(self, read_only: bool = False, client_id: Optional[str] = None):
         self._cursor = None
+        self.read_only = read_only
+        self.client_id = client_id
+        self.pool_name = None
 
     def __enter__(self):
-        self.conn = db_pool.get_connection()
+        # With read replicas configured, read-only contexts may be served by a replica
+        router = get_replica_router()
+        if router is None:
+            self.conn = get_db_pool().get_connection()
+        else:
+            self.conn, self.pool_name = router.acquire(self.read_only, self.client_id)
         self.cursor = self.conn.cursor(dictionary=True)
         # Store the context in thread-local storage
         local_storage.db_context = self
@@ -30,6 +39,11 @@ class DatabaseContext:
             self.cursor.close()
             self.conn.close()  # Close the connection regardless of exception status
         finally:
+            if self.pool_name is not None:
+                router = get_replica_router()
+                router.release(self.pool_name)
+                if exc_type is None and not self.read_only:
+                    router.record_write(self.client_id)
             # Remove context from local storage
             del local_storage.db_context
 
@@ -39,7 +53,7 @@ class DatabaseContext:
 
     # Exposing transactional methods for use in service layer
     def begin_transaction(self):
-        self.conn.start_transaction()
+        self.conn.start_transaction(readonly=self.read_only)
 
     def commit_transaction(self):
         self.conn.commit()
@@ -50,3 +64,33 @@ class DatabaseContext:
     @cursor.setter
     def cursor(self, value):
         self._cursor = value
+
+
+class NullDatabaseContext:
+    """
+    A DatabaseContext stand-in for repositories that do not use MySQL, such as the InMemoryImageRepository.
+    """
+
+    def __init__(self, read_only: bool = False, client_id: Optional[str] = None):
+        self.read_only = read_only
+        self.client_id = client_id
+
+    def __enter__(self):
+        local_storage.db_context = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        del local_storage.db_context
+
+    @property
+    def cursor(self):
+        return None
+
+    def begin_transaction(self):
+        pass
+
+    def commit_transaction(self):
+        pass
+
+    def rollback_transaction(self):
+        pass
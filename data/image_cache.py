@@ -0,0 +1,187 @@
+# data/image_cache.py
+"""
+This module defines the ImageContentCache, an in-process cache of image bytes for the PixyProxy system.
+
+The cache is bounded by the total number of bytes it holds rather than by its number of entries. Entries are evicted
+in LRU order, and admission follows TinyLFU: a count-min sketch estimates how often every filename was requested, and
+a new image is only admitted if it was requested more often than each of the images it would evict. A single large,
+rarely requested image therefore cannot flush many small hot ones. Images larger than `max_entry_bytes` are never
+cached. Freshly generated images are put with `force=True`, since they are the ones most likely to be requested next.
+
+Each worker process holds its own cache, sized with the IMAGE_CACHE_BYTES environment variable (0 disables it).
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class FrequencySketch:
+    """
+    A count-min sketch with periodic aging, estimating how often a key was seen recently.
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+        self.samples = 0
+        self.sample_size = 10 * width
+
+    def _indexes(self, key: str):
+        for row in range(self.depth):
+            yield row, hash((row, key)) % self.width
+
+    def increment(self, key: str):
+        for row, index in self._indexes(key):
+            self.rows[row][index] += 1
+        self.samples += 1
+        if self.samples >= self.sample_size:
+            # Halve all counters, so that past popularity fades out
+            self.rows = [[count >> 1 for count in counts] for counts in self.rows]
+            self.samples //= 2
+
+    def estimate(self, key: str) -> int:
+        return min(self.rows[row][index] for row, index in self._indexes(key))
+
+
+class ImageContentCache:
+    def __init__(self, max_bytes: int, max_entry_bytes: int = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._sketch = FrequencySketch()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Gets the content of an image.
+
+        Parameters:
+        key (str): The filename of the image.
+
+        Returns:
+        Optional[bytes]: The image bytes, or None if the image is not cached.
+        """
+        with self._lock:
+            self._sketch.increment(key)
+            content = self._entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key: str, content: bytes, force: bool = False) -> bool:
+        """
+        Offers the content of an image to the cache.
+
+        A rejected offer leaves an image already cached under the key in place; code that changes the file of a
+        cached image must call `invalidate`.
+
+        Parameters:
+        key (str): The filename of the image.
+        content (bytes): The image bytes.
+        force (bool): Admit the image without comparing its frequency to the images it evicts.
+
+        Returns:
+        bool: True if the image was cached.
+        """
+        size = len(content)
+        with self._lock:
+            if size > self.max_entry_bytes or size > self.max_bytes:
+                self.rejections += 1
+                return False
+
+            # An image already cached under the key is only replaced once the new content is admitted
+            current = self._entries.get(key)
+            used = self._bytes - (len(current) if current is not None else 0)
+
+            # Pick the least recently used images that would have to make room
+            victims = []
+            freed = 0
+            for victim, victim_content in self._entries.items():
+                if used - freed + size <= self.max_bytes:
+                    break
+                if victim == key:
+                    continue
+                victims.append(victim)
+                freed += len(victim_content)
+
+            if victims and not force:
+                frequency = self._sketch.estimate(key)
+                if any(self._sketch.estimate(victim) >= frequency for victim in victims):
+                    self.rejections += 1
+                    return False
+
+            for victim in victims:
+                self._bytes -= len(self._entries.pop(victim))
+                self.evictions += 1
+            if current is not None:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = content
+            self._bytes += size
+            return True
+
+    def invalidate(self, key: str):
+        with self._lock:
+            content = self._entries.pop(key, None)
+            if content is not None:
+                self._bytes -= len(content)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        """
+        Gets the metrics of the cache.
+
+        Returns:
+        Dict: The hit ratio, the bytes and entries held and the hit, miss, eviction and rejection counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "rejections": self.rejections,
+            }
+
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageContentCache:
+    """
+    Gets the cache shared by all repositories and the image generator of this process, creating it on first use.
+
+    It is created lazily so that IMAGE_CACHE_BYTES can be set in the .env file, which is only loaded with the
+    database configuration.
+    """
+    global _image_cache
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                from data import get_config
+
+                get_config()
+                _image_cache = ImageContentCache(max_bytes=int(os.getenv('IMAGE_CACHE_BYTES', 256 * 1024 * 1024)))
+    return _image_cache
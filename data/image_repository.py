@@ -14,15 +14,18 @@ Author: djjay
 Date: 2024-03-20
 """
 
-from typing import List
+from typing import List, Optional, Tuple
 
 from fastapi import Response
 from data import get_current_db_context
 from data.database_context import DatabaseContext
-from core.models import ImageDetail, ImageDetailCreate
+from data.image_cache import get_image_cache
+from core.models import ImageDetail, ImageDetailCreate, ImageRecord
 from core.exceptions import ImageNotFoundError
 from core.image_columns import ImageColumns 
 import os
+import threading
+from datetime import datetime
 from pathlib import Path
 
 from abc import ABC, abstractmethod
@@ -35,7 +38,7 @@ class ImageRepositoryInterface:
     Date: 2022-03-30
     """
 
-    def create_image(self, guid: str, filename: str, prompt: str) -> ImageDetail:
+    def create_image(self, guid: str, filename: str, prompt: str, phash: int = None) -> ImageDetail:
         """
         Creates an image.
 
@@ -43,6 +46,7 @@ class ImageRepositoryInterface:
         guid (str): The GUID of the image.
         filename (str): The filename of the image.
         prompt (str): The prompt used to generate the image.
+        phash (int): The perceptual hash of the image, if known.
 
         Returns:
         Image: The created image.
@@ -81,24 +85,86 @@ class ImageRepositoryInterface:
         bytes: The content of the image.
         """
         pass
+
+    def get_image_records_after(self, after_id: int, limit: int, missing_hash_only: bool = False) -> List[ImageRecord]:
+        """
+        Gets a page of image records using keyset iteration over the internal ID.
+
+        Parameters:
+        after_id (int): Only records with a larger ID are returned.
+        limit (int): The maximum number of records to return.
+        missing_hash_only (bool): Only return records without a perceptual hash.
+
+        Returns:
+        List[ImageRecord]: The records, ordered by ID.
+        """
+        pass
+
+    def get_hashed_records_updated_after(self, updated_at: Optional[datetime], after_id: int, max_id: int,
+                                         limit: int) -> List[ImageRecord]:
+        """
+        Gets a page of the image records with a perceptual hash, using keyset iteration over the update time.
+
+        Parameters:
+        updated_at (Optional[datetime]): Only records updated after this time, or at this time with a larger ID,
+            are returned. None returns all records.
+        after_id (int): The ID of the last record returned for `updated_at`.
+        max_id (int): Only records with at most this ID are returned.
+        limit (int): The maximum number of records to return.
+
+        Returns:
+        List[ImageRecord]: The records, ordered by update time and ID.
+        """
+        pass
+
+    def get_last_updated_at(self) -> Optional[datetime]:
+        """
+        Gets the latest update time of any image, or None if there are no images.
+        """
+        pass
+
+    def update_image_hashes(self, hashes: List[Tuple[str, int]]) -> int:
+        """
+        Sets the perceptual hashes of many images at once.
+
+        Parameters:
+        hashes (List[Tuple[str, int]]): The GUIDs of the images and their hashes.
+
+        Returns:
+        int: The number of images updated.
+        """
+        pass
+
+    def create_images(self, images: List[ImageRecord]) -> int:
+        """
+        Creates many images at once. Images whose GUID already exists are left unchanged.
+
+        Parameters:
+        images (List[ImageRecord]): The images to create.
+
+        Returns:
+        int: The number of images created.
+        """
+        pass
     
 class MySQLImageRepository(ImageRepositoryInterface):
-    def create_image(self, prompt: str, guid: str, filename: str) -> ImageDetail:
+    def create_image(self, prompt: str, guid: str, filename: str, phash: int = None) -> ImageDetail:
         """
         Creates an image in the database and returns its ImageDetail.
 
         Parameters:
         prompt (str): The prompt for the image.
+        phash (int): The perceptual hash of the image, if known.
 
         Returns:
         ImageDetail: The ImageDetail of the created image.
         """
         # Create the image details record in the database
         query = """
-        INSERT INTO images (guid, filename, prompt)
-        VALUES (%s, %s, %s)
+        INSERT INTO images (guid, filename, prompt, phash)
+        VALUES (%s, %s, %s, %s)
         """
-        values = (guid, filename, prompt)
+        values = (guid, filename, prompt, phash)
         db = get_current_db_context()
         db.cursor.execute(query, values)
 
@@ -178,17 +244,222 @@ class MySQLImageRepository(ImageRepositoryInterface):
             raise ImageNotFoundError(f"No image found with GUID {guid}")
 
         filename = result[ImageColumns.FILENAME]
+        return Response(read_image_file(filename), media_type='image/png')
 
-        # Construct the file path
-        app_root = os.getcwd()
-        images_dir = os.path.join(app_root, 'images')
-        file_path = Path(os.path.join(images_dir, filename))
+    def get_image_records_after(self, after_id: int, limit: int, missing_hash_only: bool = False) -> list[ImageRecord]:
+        """
+        Gets a page of image records using keyset iteration over the primary key.
 
-        # Check if the file exists
-        if not file_path.is_file():
-            raise FileNotFoundError(f"No file found at {file_path}")
+        Parameters:
+        after_id (int): Only records with a larger ID are returned.
+        limit (int): The maximum number of records to return.
+        missing_hash_only (bool): Only return records without a perceptual hash.
 
+        Returns:
+        list[ImageRecord]: The records, ordered by ID.
+        """
+        query = f"""
+        SELECT id, guid, filename, prompt, phash, created_at, updated_at
+        FROM images
+        WHERE id > %s {"AND phash IS NULL" if missing_hash_only else ""}
+        ORDER BY id
+        LIMIT %s
+        """
+        db = get_current_db_context()
+        db.cursor.execute(query, (after_id, limit))
+        return [self._to_record(result) for result in db.cursor.fetchall()]
+
+    def get_hashed_records_updated_after(self, updated_at: Optional[datetime], after_id: int, max_id: int,
+                                         limit: int) -> list[ImageRecord]:
+        """
+        Gets a page of the image records with a perceptual hash, using keyset iteration over the `updated_at` index.
+
+        Parameters:
+        updated_at (Optional[datetime]): Only records updated after this time, or at this time with a larger ID,
+            are returned. None returns all records.
+        after_id (int): The ID of the last record returned for `updated_at`.
+        max_id (int): Only records with at most this ID are returned.
+        limit (int): The maximum number of records to return.
 
-        # Read and return the file bytes
-        with open(file_path, 'rb') as file:
-            return Response(file.read(), media_type='image/png')
\ No newline at end of file
+        Returns:
+        list[ImageRecord]: The records, ordered by update time and ID.
+        """
+        query = """
+        SELECT id, guid, filename, prompt, phash, created_at, updated_at
+        FROM images
+        WHERE phash IS NOT NULL AND id <= %s AND (updated_at > %s OR (updated_at = %s AND id > %s))
+        ORDER BY updated_at, id
+        LIMIT %s
+        """
+        updated_at = updated_at or datetime(1970, 1, 1)
+        db = get_current_db_context()
+        db.cursor.execute(query, (max_id, updated_at, updated_at, after_id, limit))
+        return [self._to_record(result) for result in db.cursor.fetchall()]
+
+    def get_last_updated_at(self) -> Optional[datetime]:
+        db = get_current_db_context()
+        db.cursor.execute("SELECT MAX(updated_at) AS updated_at FROM images")
+        result = db.cursor.fetchone()
+        return result[ImageColumns.UPDATED_AT] if result else None
+
+    @staticmethod
+    def _to_record(result) -> ImageRecord:
+        return ImageRecord(id=result[ImageColumns.ID], guid=result[ImageColumns.GUID],
+                           filename=result[ImageColumns.FILENAME], prompt=result[ImageColumns.PROMPT],
+                           phash=result[ImageColumns.PHASH], created_at=result[ImageColumns.CREATED_AT],
+                           updated_at=result[ImageColumns.UPDATED_AT])
+
+    def update_image_hashes(self, hashes: list[tuple[str, int]]) -> int:
+        """
+        Sets the perceptual hashes of many images with one batched update.
+
+        Parameters:
+        hashes (list[tuple[str, int]]): The GUIDs of the images and their hashes.
+
+        Returns:
+        int: The number of images updated.
+        """
+        if not hashes:
+            return 0
+        query = """
+        UPDATE images
+        SET phash = %s
+        WHERE guid = %s
+        """
+        db = get_current_db_context()
+        db.cursor.executemany(query, [(phash, guid) for guid, phash in hashes])
+        return db.cursor.rowcount
+
+    def create_images(self, images: list[ImageRecord]) -> int:
+        """
+        Creates many images with a single multi-row insert. Images whose GUID already exists are left unchanged,
+        so that an interrupted import can be run again.
+
+        Parameters:
+        images (list[ImageRecord]): The images to create.
+
+        Returns:
+        int: The number of images created.
+        """
+        if not images:
+            return 0
+        # The no-op update keeps existing rows without the warning INSERT IGNORE would raise
+        query = f"""
+        INSERT INTO images (guid, filename, prompt, phash, created_at)
+        VALUES {", ".join(["(%s, %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP))"] * len(images))}
+        ON DUPLICATE KEY UPDATE guid = guid
+        """
+        values = [value for image in images
+                  for value in (image.guid, image.filename, image.prompt, image.phash, image.created_at)]
+        db = get_current_db_context()
+        db.cursor.execute(query, values)
+        return db.cursor.rowcount
+
+
+class InMemoryImageRepository(ImageRepositoryInterface):
+    """
+    In-memory implementation of the ImageRepositoryInterface.
+
+    Image details are kept in a dict keyed by GUID, while the image content is read from the images folder
+    like the MySQL repository does. It needs no database and is used by the benchmark suite and tests.
+    """
+
+    def __init__(self):
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def create_image(self, prompt: str, guid: str, filename: str, phash: int = None) -> ImageDetail:
+        with self._lock:
+            now = datetime.now()
+            record = ImageRecord(id=len(self._images) + 1, guid=guid, filename=filename, prompt=prompt, phash=phash,
+                                 created_at=now, updated_at=now)
+            self._images[guid] = record
+        return ImageDetail(guid=guid, filename=filename, prompt=prompt)
+
+    def get_image_details_by_guid(self, guid: str) -> ImageDetail:
+        record = self._images.get(guid)
+        if record is None:
+            raise ImageNotFoundError(f"No image found with GUID {guid}")
+        return ImageDetail(guid=record.guid, filename=record.filename, prompt=record.prompt)
+
+    def get_all_image_details(self) -> list[ImageDetail]:
+        return [ImageDetail(guid=record.guid, filename=record.filename, prompt=record.prompt)
+                for record in list(self._images.values())]
+
+    def get_image_records_after(self, after_id: int, limit: int, missing_hash_only: bool = False) -> list[ImageRecord]:
+        # Records are created with increasing IDs, so the dict is already in ID order
+        records = [record for record in list(self._images.values())
+                   if record.id > after_id and not (missing_hash_only and record.phash is not None)]
+        return records[:limit]
+
+    def get_hashed_records_updated_after(self, updated_at: Optional[datetime], after_id: int, max_id: int,
+                                         limit: int) -> list[ImageRecord]:
+        after = (updated_at or datetime.min, after_id)
+        records = [record for record in list(self._images.values())
+                   if record.phash is not None and record.id <= max_id and (record.updated_at, record.id) > after]
+        return sorted(records, key=lambda record: (record.updated_at, record.id))[:limit]
+
+    def get_last_updated_at(self) -> Optional[datetime]:
+        return max((record.updated_at for record in list(self._images.values())), default=None)
+
+    def update_image_hashes(self, hashes: list[tuple[str, int]]) -> int:
+        updated = 0
+        with self._lock:
+            for guid, phash in hashes:
+                record = self._images.get(guid)
+                if record is not None:
+                    self._images[guid] = record.model_copy(update={"phash": phash, "updated_at": datetime.now()})
+                    updated += 1
+        return updated
+
+    def create_images(self, images: list[ImageRecord]) -> int:
+        created = 0
+        with self._lock:
+            for image in images:
+                if image.guid in self._images:
+                    continue
+                self._images[image.guid] = ImageRecord(id=len(self._images) + 1, guid=image.guid, filename=image.filename,
+                                                       prompt=image.prompt, phash=image.phash,
+                                                       created_at=image.created_at or datetime.now(),
+                                                       updated_at=datetime.now())
+                created += 1
+        return created
+
+    def get_image_content(self, guid: str) -> bytes:
+        image_detail = self.get_image_details_by_guid(guid)
+        return Response(read_image_file(image_detail.filename), media_type='image/png')
+
+
+def read_image_file(filename: str) -> bytes:
+    """
+    Reads the content of an image file from the images folder.
+
+    Parameters:
+    filename (str): The filename of the image.
+
+    Returns:
+    bytes: The image bytes.
+
+    Raises:
+    FileNotFoundError: If the image file does not exist.
+    """
+    # Serve hot images from memory
+    image_cache = get_image_cache()
+    content = image_cache.get(filename)
+    if content is not None:
+        return content
+
+    # Construct the file path
+    app_root = os.getcwd()
+    images_dir = os.path.join(app_root, 'images')
+    file_path = Path(os.path.join(images_dir, filename))
+
+    # Check if the file exists
+    if not file_path.is_file():
+        raise FileNotFoundError(f"No file found at {file_path}")
+
+    # Read and return the file bytes
+    with open(file_path, 'rb') as file:
+        content = file.read()
+    image_cache.put(filename, content)
+    return content
\ No newline at end of file
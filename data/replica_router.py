@@ -0,0 +1,198 @@
+# data/replica_router.py
+"""
+This module defines the ReplicaRouter, which routes the database connections of the PixyProxy system between the
+primary and a set of read replicas.
+
+- Write contexts always use the primary pool.
+- Read-only contexts use the healthy replica with the fewest connections in use (least-connections selection).
+- Read-your-writes: for a short window after a client wrote, its reads stick to the primary, so it sees its own writes.
+  Each worker process remembers the clients that wrote through it. The time of a client's last write is also
+  handed back to the client itself (see `WriteSession` and web/middleware.py). The client sends it with its next
+  requests, so the window holds whichever worker serves them. A client can only use this value to send its own
+  reads to the primary.
+- A background thread checks every replica. A replica that does not answer, or whose replication lag exceeds the
+  threshold, receives no reads until it recovers. Without a healthy replica all reads fall back to the primary.
+
+Replication lag is read from `SHOW REPLICA STATUS` (`Seconds_Behind_Source`), so the database user needs the
+REPLICATION CLIENT privilege on the replicas.
+
+The router is configured with environment variables, see `data.get_replica_router`:
+- DB_REPLICA_HOSTS: comma separated host:port list of replicas; replica routing is disabled when unset.
+- DB_REPLICA_MAX_LAG_SECONDS: the lag above which a replica receives no reads (default 5).
+- DB_READ_YOUR_WRITES_SECONDS: how long reads of a client stick to the primary after a write (default 5).
+- DB_REPLICA_HEALTH_INTERVAL: the seconds between health checks (default 2).
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Tuple
+
+PRIMARY = "primary"
+
+
+class WriteSession:
+    """
+    The last write of the client of the current request, as carried by the client between requests.
+    """
+
+    def __init__(self, last_write: Optional[float] = None):
+        self.last_write = last_write  # Wall clock time, so that it compares across worker processes
+        self.wrote = False
+        self.sticky_seconds = None
+
+
+# The WriteSession of the request being served, set by the web layer
+write_session: ContextVar[Optional[WriteSession]] = ContextVar("write_session", default=None)
+
+
+def replication_lag(conn) -> Optional[float]:
+    """
+    Gets the replication lag of a replica in seconds.
+
+    Returns:
+    Optional[float]: The lag, or None if the server is not replicating.
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+        status = cursor.fetchone()
+        cursor.fetchall()
+    finally:
+        cursor.close()
+    if not status:
+        return None
+    lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+    return float(lag) if lag is not None else None
+
+
+class ReplicaRouter:
+    def __init__(self, primary_pool, replica_pools: Dict[str, object], max_lag_seconds: float = 5.0,
+                 sticky_seconds: float = 5.0, health_interval: float = 2.0,
+                 lag_probe: Callable[[object], Optional[float]] = replication_lag):
+        self.primary_pool = primary_pool
+        self.replica_pools = replica_pools
+        self.max_lag_seconds = max_lag_seconds
+        self.sticky_seconds = sticky_seconds
+        self.health_interval = health_interval
+        self.lag_probe = lag_probe
+        self._lock = threading.Lock()
+        self._in_use = {name: 0 for name in replica_pools}
+        self._healthy = {name: False for name in replica_pools}
+        self._lag: Dict[str, Optional[float]] = {name: None for name in replica_pools}
+        self._last_write: OrderedDict = OrderedDict()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reads = {PRIMARY: 0, **{name: 0 for name in replica_pools}}
+
+    def start(self):
+        """
+        Checks the replicas once and then keeps checking them on a background thread.
+        """
+        self.check_health()
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def check_health(self):
+        for name, pool in self.replica_pools.items():
+            try:
+                conn = pool.get_connection()
+                try:
+                    lag = self.lag_probe(conn)
+                finally:
+                    conn.close()
+            except Exception:
+                lag = None
+            with self._lock:
+                self._lag[name] = lag
+                self._healthy[name] = lag is not None and lag <= self.max_lag_seconds
+
+    def record_write(self, client_id: Optional[str]):
+        """
+        Makes the reads of a client stick to the primary for the read-your-writes window.
+        """
+        session = write_session.get()
+        if session is not None:
+            session.last_write = time.time()
+            session.wrote = True
+            session.sticky_seconds = self.sticky_seconds
+        if client_id is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._last_write[client_id] = now
+            self._last_write.move_to_end(client_id)
+            # Forget clients whose window has passed; the oldest writes are at the front
+            while self._last_write:
+                oldest = next(iter(self._last_write))
+                if now - self._last_write[oldest] <= self.sticky_seconds:
+                    break
+                del self._last_write[oldest]
+
+    def _is_sticky(self, client_id: Optional[str]) -> bool:
+        last_write = self._last_write.get(client_id) if client_id is not None else None
+        if last_write is not None and time.monotonic() - last_write <= self.sticky_seconds:
+            return True
+        # A write the client made through another worker process
+        session = write_session.get()
+        return (session is not None and session.last_write is not None
+                and time.time() - session.last_write <= self.sticky_seconds)
+
+    def acquire(self, read_only: bool = False, client_id: Optional[str] = None) -> Tuple[object, str]:
+        """
+        Gets a connection for a database context.
+
+        Parameters:
+        read_only (bool): Whether the context only reads.
+        client_id (Optional[str]): The client the context works for, used for read-your-writes.
+
+        Returns:
+        Tuple[object, str]: The connection and the name of its pool, to be passed to `release`.
+        """
+        if read_only:
+            with self._lock:
+                candidates = [name for name, healthy in self._healthy.items() if healthy]
+                name = None
+                if candidates and not self._is_sticky(client_id):
+                    name = min(candidates, key=lambda candidate: self._in_use[candidate])
+                    self._in_use[name] += 1
+            if name is not None:
+                try:
+                    conn = self.replica_pools[name].get_connection()
+                    with self._lock:
+                        self.reads[name] += 1
+                    return conn, name
+                except Exception:
+                    # Exhausted or unreachable; leave it out until the next health check
+                    with self._lock:
+                        self._in_use[name] -= 1
+                        self._healthy[name] = False
+            with self._lock:
+                self.reads[PRIMARY] += 1
+        return self.primary_pool.get_connection(), PRIMARY
+
+    def release(self, name: str):
+        if name != PRIMARY:
+            with self._lock:
+                self._in_use[name] -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "replicas": {name: {"healthy": self._healthy[name], "lag_seconds": self._lag[name],
+                                    "in_use": self._in_use[name], "reads": self.reads[name]}
+                             for name in self.replica_pools},
+                "primary_reads": self.reads[PRIMARY],
+                "sticky_clients": len(self._last_write),
+            }
@@ -0,0 +1,16 @@
+-- MySQL Script
+-- File: /data/scripts/add_phash.sql
+"""
+This script adds the `phash` column to the `images` table of an existing PixyProxy database.
+
+The column holds the 64-bit perceptual (difference) hash of each image and is used for near-duplicate detection.
+It is NULL for images created before this migration until the backfill job (backfill_hashes.py) has run.
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+USE `pixyproxy`;
+
+ALTER TABLE `images`
+  ADD COLUMN `phash` BIGINT UNSIGNED NULL AFTER `prompt`;
@@ -8,6 +8,7 @@ The `images` table has the following columns:
 - `guid`: a unique identifier for each image.
 - `filename`: the name of the file where the image is stored.
 - `prompt`: the text prompt used to generate the image.
+- `phash`: the 64-bit perceptual (difference) hash of the image, used for near-duplicate detection.
 - `created_at`: the timestamp when the image record was created.
 - `updated_at`: the timestamp when the image record was last updated.
 
@@ -26,6 +27,7 @@ CREATE TABLE `images` (
   `guid` VARCHAR(36) NOT NULL,
   `filename` VARCHAR(255) NOT NULL,
   `prompt` TEXT NOT NULL,
+  `phash` BIGINT UNSIGNED NULL,
   `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
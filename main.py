@@ -6,29 +6,68 @@ Author: djjay
 Date: 2024-03-20
 """
 
+import os
 import traceback
+from contextlib import asynccontextmanager
+from anyio import to_thread
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from core.exceptions import EXCEPTION_STATUS_CODES, ImageException
-from web.middleware import LoggingMiddleware, RequestIdMiddleware
-from web.routers import image_router
+from data import check_db_pool, get_pool_size, get_replica_router
+from web.middleware import LoggingMiddleware, ReadYourWritesMiddleware, RequestIdMiddleware
+from web.request_capture import RequestCapture
+from web.routers import image_router, metrics_router, transfer_router
 from fastapi import HTTPException
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync endpoints run on the anyio threadpool and each one holds a pooled DB connection,
+    # so by default the threadpool is sized to the DB pool to avoid "pool exhausted" errors.
+    to_thread.current_default_thread_limiter().total_tokens = int(os.getenv('THREADPOOL_SIZE', get_pool_size()))
+
+    # Fail fast: refuse to start serving if the database cannot be reached.
+    # This also creates the DB pool; DB_CHECK_ON_STARTUP=false defers it to the first request.
+    if _env_flag('DB_CHECK_ON_STARTUP'):
+        check_db_pool()
+
+    # Warm-up creates the replica pools and the OpenAI client before the first request is served.
+    # With WARMUP_ON_STARTUP=false they are created lazily on first use instead.
+    if _env_flag('WARMUP_ON_STARTUP'):
+        from core.image_generator import get_openai_client
+
+        get_replica_router()
+        get_openai_client()
+    yield
+
+def _env_flag(name: str, default: str = 'true') -> bool:
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
 # Create a new FastAPI application
 app = FastAPI(
     title="PixyProxy",
     description="API endpoints for image creation from prompts, storage of image metadata and content, listing of image details, and delivery of image content.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Include the images router
 app.include_router(image_router.router, prefix="/image")
 
+# Include the bulk export and import router
+app.include_router(transfer_router.router, prefix="/transfer")
+
+# Include the metrics router
+app.include_router(metrics_router.router, prefix="/metrics")
+
+# Add the ReadYourWritesMiddleware to the middleware stack, carrying the last write of a client across workers
+app.add_middleware(ReadYourWritesMiddleware)
+
 # Add the RequestIdMiddleware to the middleware stack
 app.add_middleware(RequestIdMiddleware)
 
-# Add the LoggingMiddleware to the middleware stack
-app.add_middleware(LoggingMiddleware)
+# Add the LoggingMiddleware to the middleware stack, capturing requests when CAPTURE_FILE is set
+# (in the environment or the .env file, which is not loaded yet at import time)
+app.add_middleware(LoggingMiddleware, capture_factory=RequestCapture.from_env)
 
 # Exception handler for generic exceptions
 @app.exception_handler(Exception)
@@ -0,0 +1,111 @@
+# serve.py
+"""
+This file is the production launcher for the PixyProxy system.
+
+It pre-forks a number of uvicorn worker processes serving `main:app`, using uvloop and httptools when they are
+installed. Workers drain in-flight requests on SIGTERM and are recycled after a (jittered) number of requests.
+
+The total database connection budget is divided across the workers, so that N workers never open more than the
+budget against MySQL. The per-worker DB pool size and threadpool size are handed to the workers through the
+DB_POOL_SIZE and THREADPOOL_SIZE environment variables. A worker that cannot establish its pool fails its startup,
+which stops the launcher.
+
+Usage:
+    python serve.py --workers 4 --db-connection-budget 100
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import argparse
+import os
+from typing import Tuple
+
+import uvicorn
+from dotenv import load_dotenv
+
+# mysql-connector refuses pools larger than this (mysql.connector.pooling.CNX_POOL_MAXSIZE)
+MAX_POOL_SIZE = 32
+
+
+def compute_worker_resources(workers: int, db_connection_budget: int, threads_per_worker: int = None) -> Tuple[int, int]:
+    """
+    Divides the database connection budget across the worker processes.
+
+    The pool size of a worker is capped at MAX_POOL_SIZE, so a budget larger than workers * MAX_POOL_SIZE is not
+    used up.
+
+    Parameters:
+    workers (int): The number of worker processes.
+    db_connection_budget (int): The total number of DB connections all workers together may open.
+    threads_per_worker (int): The threadpool size per worker. Defaults to the per-worker pool size.
+
+    Returns:
+    Tuple[int, int]: The DB pool size and the threadpool size for each worker.
+
+    Raises:
+    ValueError: If the budget does not allow at least one connection per worker.
+    """
+    if workers < 1:
+        raise ValueError("At least one worker is required.")
+    pool_size = db_connection_budget // workers
+    if pool_size < 1:
+        raise ValueError(f"A budget of {db_connection_budget} DB connections cannot serve {workers} workers.")
+    pool_size = min(pool_size, MAX_POOL_SIZE)
+
+    # Every request served on the threadpool holds a pooled connection, so more threads than
+    # connections would only turn into "pool exhausted" errors.
+    if threads_per_worker is None or threads_per_worker > pool_size:
+        threads_per_worker = pool_size
+    return pool_size, threads_per_worker
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run PixyProxy with multiple worker processes.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8001)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--db-connection-budget", type=int, default=int(os.getenv("DB_CONNECTION_BUDGET", 100)),
+                        help="Total DB connections across all workers; keep below MySQL's max_connections.")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Threadpool size per worker; capped at the per-worker DB pool size.")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("MAX_REQUESTS", 10000)),
+                        help="Recycle a worker after this many requests (0 disables recycling).")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.getenv("MAX_REQUESTS_JITTER", 1000)),
+                        help="Random extra requests per worker, so workers do not all recycle at once.")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", 30)),
+                        help="Seconds a worker may spend draining in-flight requests on SIGTERM.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+
+    pool_size, threads = compute_worker_resources(args.workers, args.db_connection_budget, args.threads_per_worker)
+
+    # The workers are spawned processes and inherit the environment of the launcher
+    os.environ['DB_POOL_SIZE'] = str(pool_size)
+    os.environ['THREADPOOL_SIZE'] = str(threads)
+
+    if pool_size * args.workers < args.db_connection_budget:
+        print(f"Using {pool_size * args.workers} of the {args.db_connection_budget} DB connections, "
+              f"as a worker cannot pool more than {MAX_POOL_SIZE}")
+    print(f"Starting {args.workers} workers with db_pool_size={pool_size} threadpool_size={threads}")
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="auto",  # uvloop when installed
+        http="auto",  # httptools when installed
+        lifespan="on",
+        limit_max_requests=args.max_requests or None,
+        limit_max_requests_jitter=args.max_requests_jitter,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+# service/generation_progress.py
+"""
+This module tracks the image generations in progress and fans their lifecycle events out to any number of subscribers.
+
+A generation publishes these events, in order:
+
+    queued              {"position": n}, again whenever the estimated queue position changes (0: starting now)
+    started             {}
+    upstream-complete   {"bytes": n}, once the image was received from the upstream
+    stored              {"guid": ...}, once the image was written and its row inserted (not sent for deduplicated images)
+    done                the ImageDetail of the image, and "last_write" if the image was stored (see below)
+    error               {"detail": ...}, instead of done when the generation failed
+
+Every request starts its own generation, scheduled for its own client and priority, since the same prompt is often
+generated again on purpose to get another variant. Subscribers attach to the latest generation in progress of a
+prompt, so a client that lost its stream (or another client) follows that generation instead of polling or retrying.
+
+The response headers of a stream are sent before its image is stored, so the read-your-writes header of
+web/middleware.py cannot come with them. The done event carries its value as "last_write" instead: a client that
+sends it back as the X-Last-Write header reads the new image from the primary, whichever worker serves it.
+
+The pub/sub is in-process and runs on the event loop. Every subscriber has a small bounded buffer; when a slow consumer
+falls behind, its oldest pending events are dropped, so it always catches up with the latest state (and the final
+event) without slowing down the publisher or the other subscribers. A new subscriber first receives the latest event
+of the generation. Waiting for the scheduler and for events holds neither a thread nor a database connection; only the
+generation itself runs on the threadpool.
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import asyncio
+import functools
+import itertools
+import json
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from core.models import ImageDetail, ImageDetailCreate
+from data.replica_router import write_session
+from service.generation_scheduler import GenerationScheduler, GenerationTicket, INTERACTIVE, get_generation_scheduler
+from service.image_service import ImageServiceInterface
+
+QUEUED = "queued"
+STARTED = "started"
+UPSTREAM_COMPLETE = "upstream-complete"
+STORED = "stored"
+DONE = "done"
+ERROR = "error"
+TERMINAL_EVENTS = (DONE, ERROR)
+
+
+class GenerationEvent:
+    __slots__ = ("name", "data")
+
+    def __init__(self, name: str, data: Dict):
+        self.name = name
+        self.data = data
+
+    def encode(self) -> bytes:
+        """
+        Encodes the event as a Server-Sent Event.
+        """
+        return f"event: {self.name}\ndata: {json.dumps(self.data)}\n\n".encode("utf-8")
+
+
+class Subscription:
+    def __init__(self, max_pending: int = 16):
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._events: Deque[GenerationEvent] = deque()
+        self._waiter: Optional[asyncio.Future] = None
+
+    def push(self, event: GenerationEvent):
+        if len(self._events) >= self.max_pending:
+            self._events.popleft()
+            self.dropped += 1
+        self._events.append(event)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def next(self, timeout: float) -> Optional[GenerationEvent]:
+        """
+        Waits for the next event.
+
+        Parameters:
+        timeout (float): The number of seconds to wait.
+
+        Returns:
+        Optional[GenerationEvent]: The event, or None if there was none within the timeout.
+        """
+        if not self._events:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self._waiter = None
+        return self._events.popleft()
+
+
+class GenerationRun:
+    _ids = itertools.count(1)
+
+    def __init__(self, prompt: str):
+        self.id = next(self._ids)
+        self.prompt = prompt
+        self.subscribers = set()
+        self.last_event: Optional[GenerationEvent] = None
+        self.future = asyncio.get_running_loop().create_future()
+        # Mark the outcome as retrieved, a generation may well have subscribers only
+        self.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self.task = None
+
+    def publish(self, name: str, **data):
+        event = GenerationEvent(name, data)
+        self.last_event = event
+        for subscription in self.subscribers:
+            subscription.push(event)
+
+    def subscribe(self, max_pending: int = 16) -> Subscription:
+        subscription = Subscription(max_pending)
+        if self.last_event is not None:
+            subscription.push(self.last_event)
+        self.subscribers.add(subscription)
+        return subscription
+
+
+class GenerationProgress:
+    def __init__(self, scheduler: GenerationScheduler, max_pending: int = 16, position_interval: float = 1.0):
+        """
+        Creates the tracker of the generations in progress.
+
+        Parameters:
+        scheduler (GenerationScheduler): The scheduler the generations wait in.
+        max_pending (int): The number of events buffered per subscriber before the oldest ones are dropped.
+        position_interval (float): How often, in seconds, the queue position of a waiting generation is checked.
+        """
+        self.scheduler = scheduler
+        self.max_pending = max_pending
+        self.position_interval = position_interval
+        self.runs: Dict[int, GenerationRun] = {}
+        self._prompts: Dict[str, List[GenerationRun]] = {}  # The runs in progress of every prompt, oldest first
+        self.dropped = 0
+
+    def start(self, image: ImageDetailCreate, service: ImageServiceInterface, client_id: str,
+              priority: str = INTERACTIVE) -> GenerationRun:
+        """
+        Starts the generation of an image.
+
+        Parameters:
+        image (ImageDetailCreate): The image to generate.
+        service (ImageServiceInterface): The service that generates and stores the image.
+        client_id (str): The API client the generation is scheduled for.
+        priority (str): The priority class of the generation.
+
+        Returns:
+        GenerationRun: The generation; its `future` resolves to the ImageDetail.
+
+        Raises:
+        BadRequestError: If the priority class is unknown.
+        TooManyRequestsError: If the client has too many generations waiting.
+        """
+        ticket = self.scheduler.enqueue(client_id, priority)
+        run = GenerationRun(image.prompt)
+        self.runs[run.id] = run
+        self._prompts.setdefault(run.prompt, []).append(run)
+        run.task = asyncio.create_task(self._execute(run, ticket, image, service))
+        return run
+
+    def get_run(self, prompt: str) -> Optional[GenerationRun]:
+        """
+        Gets the latest generation in progress of a prompt, if any.
+        """
+        runs = self._prompts.get(prompt)
+        return runs[-1] if runs else None
+
+    def subscribe(self, run: GenerationRun) -> Subscription:
+        return run.subscribe(self.max_pending)
+
+    def unsubscribe(self, run: GenerationRun, subscription: Subscription):
+        run.subscribers.discard(subscription)
+        self.dropped += subscription.dropped
+
+    async def _execute(self, run: GenerationRun, ticket: GenerationTicket, image: ImageDetailCreate,
+                       service: ImageServiceInterface):
+        loop = asyncio.get_running_loop()
+
+        def progress(name: str, **data):
+            # Called on the worker thread of the generation
+            loop.call_soon_threadsafe(functools.partial(run.publish, name, **data))
+
+        try:
+            waiting = asyncio.ensure_future(self.scheduler.wait(ticket))
+            try:
+                position = None
+                while True:
+                    current = self.scheduler.position(ticket)
+                    if current != position:
+                        run.publish(QUEUED, position=current)
+                        position = current
+                    if waiting.done():
+                        break
+                    await asyncio.wait({waiting}, timeout=self.position_interval)
+            except asyncio.CancelledError:
+                waiting.cancel()  # Takes the ticket out of the queue, or frees its slot
+                raise
+            await waiting
+
+            try:
+                run.publish(STARTED)
+                image_detail = await run_in_threadpool(service.create_image, image, progress)
+            finally:
+                self.scheduler.release(ticket)
+        except asyncio.CancelledError:
+            run.publish(ERROR, detail="The generation was cancelled.")
+            run.future.cancel()
+            raise
+        except Exception as e:
+            run.publish(ERROR, detail=str(e))
+            run.future.set_exception(e)
+        else:
+            data = image_detail.model_dump(mode="json")
+            # The task runs in the context of the request that started it, and the write was recorded in its session
+            session = write_session.get()
+            if session is not None and session.wrote:
+                data["last_write"] = f"{session.last_write:.3f}"
+            run.publish(DONE, **data)
+            run.future.set_result(image_detail)
+        finally:
+            del self.runs[run.id]
+            # Runs of a prompt can complete in any order, the earlier ones stay available
+            runs = self._prompts[run.prompt]
+            runs.remove(run)
+            if not runs:
+                del self._prompts[run.prompt]
+
+    async def generate(self, image: ImageDetailCreate, service: ImageServiceInterface, client_id: str,
+                       priority: str = INTERACTIVE) -> ImageDetail:
+        """
+        Generates an image, publishing its progress to the subscribers of its prompt.
+        """
+        run = self.start(image, service, client_id, priority)
+        # Shielded, so a caller that goes away does not cancel the generation its subscribers follow
+        return await asyncio.shield(run.future)
+
+    def stats(self) -> Dict:
+        return {
+            "in_progress": len(self.runs),
+            "subscribers": sum(len(run.subscribers) for run in self.runs.values()),
+            "dropped_events": self.dropped + sum(subscription.dropped for run in self.runs.values()
+                                                 for subscription in run.subscribers),
+        }
+
+
+_progress = None
+_progress_lock = threading.Lock()
+
+
+def get_generation_progress() -> GenerationProgress:
+    """
+    Gets the tracker of the generations in progress of this process, creating it on first use.
+    """
+    global _progress
+    if _progress is None:
+        with _progress_lock:
+            if _progress is None:
+                _progress = GenerationProgress(get_generation_scheduler())
+    return _progress
@@ -0,0 +1,330 @@
+# service/generation_scheduler.py
+"""
+This module defines the GenerationScheduler, which decides which image generation runs next when the upstream is busy.
+
+Generations are queued per API client (see `get_client_id` in web/dependencies.py) and per priority class, interactive
+or batch. Whenever a generation slot frees up, the scheduler picks the next request with weighted fair queuing in its
+stride scheduling form, on two levels:
+
+    1. the priority class with the lowest pass among the classes with a runnable request, then
+    2. the client with the lowest pass among the runnable clients of that class.
+
+Every dispatch advances the pass of the chosen class and client by the inverse of their weight, so with the default
+weights interactive requests get eight slots for every batch slot, and clients of the same class share their slots
+evenly (or by their configured weights), however many requests each of them queued. A class or client that was idle
+starts again at the current virtual time of its level, so it cannot bank credit while it sends nothing. A client with
+`client_concurrency` generations running is skipped until one of them completes.
+
+The scheduler runs on the event loop: waiting requests are futures, so they hold neither a thread nor a database
+connection. It is not thread-safe, and all its methods must be called from the event loop.
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from core.exceptions import BadRequestError, TooManyRequestsError
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITY_CLASSES = (INTERACTIVE, BATCH)
+DEFAULT_CLASS_WEIGHTS = {INTERACTIVE: 8.0, BATCH: 1.0}
+
+# Number of recent wait times kept per class for the percentiles in the metrics
+WAIT_SAMPLES = 1024
+
+
+class GenerationTicket:
+    __slots__ = ("client_id", "priority", "enqueued_at", "started_at", "future")
+
+    def __init__(self, client_id: str, priority: str, future: asyncio.Future):
+        self.client_id = client_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.future = future
+
+
+class _ClientQueue:
+    def __init__(self, weight: float, pass_value: float):
+        self.weight = weight
+        self.pass_value = pass_value
+        self.tickets: Deque[GenerationTicket] = deque()
+
+
+class _PriorityClass:
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.pass_value = 0.0
+        self.virtual_time = 0.0  # The pass of the client that was dispatched last
+        self.clients: Dict[str, _ClientQueue] = {}
+        self.queued = 0
+        self.running = 0
+        self.dispatched = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class GenerationScheduler:
+    def __init__(self, concurrency: int, client_concurrency: Optional[int] = None,
+                 class_weights: Optional[Dict[str, float]] = None, client_weights: Optional[Dict[str, float]] = None,
+                 max_queued_per_client: int = 100):
+        """
+        Creates a scheduler.
+
+        Parameters:
+        concurrency (int): The number of generations running at the same time, i.e. the upstream capacity.
+        client_concurrency (int): The number of generations one client can have running, by default all of them.
+        class_weights (Dict[str, float]): The weight of every priority class.
+        client_weights (Dict[str, float]): The weight of particular clients within their class, 1 by default.
+        max_queued_per_client (int): The number of requests one client can have waiting.
+        """
+        self.concurrency = concurrency
+        self.client_concurrency = client_concurrency or concurrency
+        self.client_weights = client_weights or {}
+        self.max_queued_per_client = max_queued_per_client
+        weights = {**DEFAULT_CLASS_WEIGHTS, **(class_weights or {})}
+        self.classes = {name: _PriorityClass(name, weights[name]) for name in PRIORITY_CLASSES}
+        self.virtual_time = 0.0  # The pass of the class that was dispatched last
+        self.running = 0
+        self.client_running: Dict[str, int] = {}
+        self.client_queued: Dict[str, int] = {}
+
+    async def acquire(self, client_id: str, priority: str = INTERACTIVE) -> GenerationTicket:
+        """
+        Waits until a generation of a client may start.
+
+        Parameters:
+        client_id (str): The API client the generation is for.
+        priority (str): The priority class of the generation, interactive or batch.
+
+        Returns:
+        GenerationTicket: The ticket to pass to `release` once the generation completed.
+
+        Raises:
+        BadRequestError: If the priority class is unknown.
+        TooManyRequestsError: If the client already has `max_queued_per_client` requests waiting.
+        """
+        return await self.wait(self.enqueue(client_id, priority))
+
+    def enqueue(self, client_id: str, priority: str = INTERACTIVE) -> GenerationTicket:
+        """
+        Queues a generation without waiting for it, for callers that report the queue position while they wait.
+        The ticket must be passed to `wait`. Raises the same errors as `acquire`.
+        """
+        ticket = self._enqueue(client_id, priority)
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket: GenerationTicket) -> GenerationTicket:
+        """
+        Waits until a queued generation may start.
+        """
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.cancelled():
+                self._remove(ticket)
+            else:
+                # The slot was granted while the waiter was being cancelled
+                self.release(ticket)
+            raise
+        return ticket
+
+    def position(self, ticket: GenerationTicket) -> int:
+        """
+        Estimates the position of a queued generation: 1 plus the generations of its class queued before it.
+        Returns 0 once the generation started. Weighted fair queuing can still move it ahead of earlier requests.
+        """
+        if ticket.started_at is not None:
+            return 0
+        ahead = 0
+        for client in self.classes[ticket.priority].clients.values():
+            for queued in client.tickets:
+                if queued.enqueued_at >= ticket.enqueued_at:
+                    break
+                ahead += 1
+        return ahead + 1
+
+    def release(self, ticket: GenerationTicket):
+        """
+        Frees the slot of a completed generation and starts the next one.
+        """
+        self.running -= 1
+        self.classes[ticket.priority].running -= 1
+        self.client_running[ticket.client_id] -= 1
+        if not self.client_running[ticket.client_id]:
+            del self.client_running[ticket.client_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, client_id: str, priority: str = INTERACTIVE):
+        """
+        Holds a generation slot for the duration of the context.
+        """
+        ticket = await self.acquire(client_id, priority)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _enqueue(self, client_id: str, priority: str) -> GenerationTicket:
+        priority_class = self.classes.get(priority)
+        if priority_class is None:
+            raise BadRequestError(f"Unknown priority '{priority}', expected one of {', '.join(PRIORITY_CLASSES)}.")
+        if self.client_queued.get(client_id, 0) >= self.max_queued_per_client:
+            raise TooManyRequestsError(f"Too many queued generations for this client, "
+                                       f"at most {self.max_queued_per_client} can wait.")
+
+        # An idle class or client restarts at the virtual time of its level, so it cannot bank credit
+        if not priority_class.queued:
+            priority_class.pass_value = max(priority_class.pass_value, self.virtual_time)
+        client = priority_class.clients.get(client_id)
+        if client is None:
+            client = _ClientQueue(self.client_weights.get(client_id, 1.0), priority_class.virtual_time)
+            priority_class.clients[client_id] = client
+
+        ticket = GenerationTicket(client_id, priority, asyncio.get_running_loop().create_future())
+        client.tickets.append(ticket)
+        priority_class.queued += 1
+        self.client_queued[client_id] = self.client_queued.get(client_id, 0) + 1
+        return ticket
+
+    def _remove(self, ticket: GenerationTicket):
+        priority_class = self.classes[ticket.priority]
+        client = priority_class.clients.get(ticket.client_id)
+        if client is not None and ticket in client.tickets:
+            client.tickets.remove(ticket)
+            self._forget(priority_class, ticket.client_id, client)
+
+    def _forget(self, priority_class: _PriorityClass, client_id: str, client: _ClientQueue):
+        # Bookkeeping for a ticket that left the queue
+        priority_class.queued -= 1
+        self.client_queued[client_id] -= 1
+        if not self.client_queued[client_id]:
+            del self.client_queued[client_id]
+        if not client.tickets:
+            del priority_class.clients[client_id]
+
+    def _runnable_client(self, priority_class: _PriorityClass):
+        best = None
+        for client_id, client in priority_class.clients.items():
+            if self.client_running.get(client_id, 0) >= self.client_concurrency:
+                continue
+            if best is None or client.pass_value < best[1].pass_value:
+                best = (client_id, client)
+        return best
+
+    def _dispatch(self):
+        while self.running < self.concurrency:
+            chosen = None
+            for priority_class in self.classes.values():
+                if not priority_class.queued or (chosen and chosen[0].pass_value <= priority_class.pass_value):
+                    continue
+                runnable = self._runnable_client(priority_class)
+                if runnable is not None:
+                    chosen = (priority_class, *runnable)
+            if chosen is None:
+                return
+
+            priority_class, client_id, client = chosen
+            ticket = client.tickets.popleft()
+            self._forget(priority_class, client_id, client)
+            if ticket.future.done():
+                continue  # Cancelled, its waiter has not run yet
+
+            self.virtual_time = priority_class.pass_value
+            priority_class.pass_value += 1.0 / priority_class.weight
+            priority_class.virtual_time = client.pass_value
+            client.pass_value += 1.0 / client.weight
+
+            ticket.started_at = time.monotonic()
+            priority_class.waits.append(ticket.started_at - ticket.enqueued_at)
+            priority_class.dispatched += 1
+            priority_class.running += 1
+            self.running += 1
+            self.client_running[client_id] = self.client_running.get(client_id, 0) + 1
+            ticket.future.set_result(ticket)
+
+    def stats(self) -> Dict:
+        """
+        Gets the queue depth, running generations and wait times of every priority class.
+        """
+        classes = {}
+        for name, priority_class in self.classes.items():
+            waits = list(priority_class.waits)
+            classes[name] = {
+                "weight": priority_class.weight,
+                "queued": priority_class.queued,
+                "running": priority_class.running,
+                "dispatched": priority_class.dispatched,
+                "wait_seconds": {
+                    "mean": sum(waits) / len(waits) if waits else 0.0,
+                    "p50": _percentile(waits, 0.50) if waits else 0.0,
+                    "p95": _percentile(waits, 0.95) if waits else 0.0,
+                    "max": max(waits) if waits else 0.0,
+                },
+            }
+        return {
+            "concurrency": self.concurrency,
+            "client_concurrency": self.client_concurrency,
+            "running": self.running,
+            "queued_clients": len(self.client_queued),
+            "classes": classes,
+        }
+
+
+def _parse_weights(value: str) -> Dict[str, float]:
+    # "name=weight,name=weight", e.g. "interactive=8,batch=1"
+    weights = {}
+    for item in value.split(","):
+        name, _, weight = item.strip().rpartition("=")
+        if name:
+            weights[name] = float(weight)
+    return weights
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_generation_scheduler() -> GenerationScheduler:
+    """
+    Gets the generation scheduler of this process, creating it from the environment on first use.
+
+    GENERATION_CONCURRENCY sets the upstream capacity, GENERATION_CLIENT_CONCURRENCY the per-client cap,
+    GENERATION_CLASS_WEIGHTS and GENERATION_CLIENT_WEIGHTS the weights as "name=weight,...", and
+    GENERATION_MAX_QUEUED_PER_CLIENT the per-client queue limit.
+
+    A running generation holds a threadpool thread and a DB connection for the whole upstream call, so by default the
+    capacity is half of the smaller of the DB pool and the threadpool: the other half stays free for the sync routes,
+    which would otherwise stall behind a burst of generations.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from data import get_pool_size
+
+                pool_size = get_pool_size()
+                threads = int(os.getenv('THREADPOOL_SIZE', pool_size))
+                concurrency = int(os.getenv('GENERATION_CONCURRENCY', max(1, min(pool_size, threads) // 2)))
+                _scheduler = GenerationScheduler(
+                    concurrency,
+                    client_concurrency=int(os.getenv('GENERATION_CLIENT_CONCURRENCY', concurrency)),
+                    class_weights=_parse_weights(os.getenv('GENERATION_CLASS_WEIGHTS', '')),
+                    client_weights=_parse_weights(os.getenv('GENERATION_CLIENT_WEIGHTS', '')),
+                    max_queued_per_client=int(os.getenv('GENERATION_MAX_QUEUED_PER_CLIENT', 100)))
+    return _scheduler
@@ -15,10 +15,10 @@ from pydantic import BaseModel, ValidationError
 from core import image_generator
 from core.exceptions import ConstraintViolationError, DataValidationError, ImageException, InvalidOperationError
 from data.database_context import DatabaseContext
-from data import db_pool, local_storage
+from data import local_storage
 from data.image_repository import ImageRepositoryInterface
 from core.models import ImageDetail, ImageDetailCreate
-from typing import List
+from typing import Callable, List, Optional
 
 class ImageServiceInterface:
     """
@@ -27,12 +27,13 @@ class ImageServiceInterface:
     Date: 2022-03-30
     """
 
-    def create_image(self, image_detail: ImageDetailCreate) -> ImageDetail:
+    def create_image(self, image_detail: ImageDetailCreate, progress: Optional[Callable[..., None]] = None) -> ImageDetail:
         """
         Creates an image.
 
         Parameters:
         image_detail (ImageDetailCreate): The details of the image to be created.
+        progress (Callable): Called with the name and data of every completed generation step, see ImageGenerator.
 
         Returns:
         Image: The created image.
@@ -73,53 +74,61 @@ class ImageServiceInterface:
         pass
 
 class ImageService(ImageServiceInterface):
-    def __init__(self, image_repo: ImageRepositoryInterface, image_generator: image_generator):
+    def __init__(self, image_repo: ImageRepositoryInterface, image_generator: image_generator,
+                 db_context=DatabaseContext, client_id: str = None, similarity_service=None):
         self.image_repo = image_repo
         self.image_generator = image_generator
+        self.db_context = db_context
+        self.client_id = client_id
+        self.similarity_service = similarity_service
 
-    def create_image(self, image: ImageDetailCreate) -> ImageDetail:
+    def create_image(self, image: ImageDetailCreate, progress: Optional[Callable[..., None]] = None) -> ImageDetail:
         try:
             image = ImageDetailCreate(**image.dict())
         except ValidationError as e:
             raise ConstraintViolationError(str(e))
 
-        with DatabaseContext() as db:
+        # Bring the near-duplicate index up to date before generating, outside the write context
+        if self.similarity_service is not None:
+            self.similarity_service.refresh()
+
+        with self.db_context(client_id=self.client_id) as db:
             db.begin_transaction()
             # Generate the image and save it to the database
-            image_detail = self.image_generator.generate_image(image)
+            image_detail = self.image_generator.generate_image(image, progress=progress)
             db.commit_transaction()
 
         return image_detail
 
     def get_image_details_by_guid(self, guid: str) -> ImageDetail:
-        with DatabaseContext() as db:
+        with self.db_context(read_only=True, client_id=self.client_id) as db:
             try:
                 db.begin_transaction()
                 image = self.image_repo.get_image_details_by_guid(guid)
                 db.commit_transaction()
                 return image
             except ImageException as e:
-                db.rollback()
+                db.rollback_transaction()
                 raise DataValidationError("Invalid GUID provided.") from e
 
     def get_image_content(self, guid: str) -> bytes:
-        with DatabaseContext() as db:
+        with self.db_context(read_only=True, client_id=self.client_id) as db:
             try:
                 db.begin_transaction()
                 image = self.image_repo.get_image_content(guid)
                 db.commit_transaction()
                 return image
             except ImageException as e:
-                db.rollback()
+                db.rollback_transaction()
                 raise DataValidationError("Invalid GUID provided.") from e
             
     def get_all_image_details(self) -> List[ImageDetail]:
-        with DatabaseContext() as db:
+        with self.db_context(read_only=True, client_id=self.client_id) as db:
             try:
                 db.begin_transaction()
                 images = self.image_repo.get_all_image_details()
                 db.commit_transaction()
                 return images
             except ImageException as e:
-                db.rollback()
+                db.rollback_transaction()
                 raise InvalidOperationError("Unable to retrieve all image details.") from e
\ No newline at end of file
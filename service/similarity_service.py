@@ -0,0 +1,213 @@
+# service/similarity_service.py
+"""
+This module defines the SimilarityService, which answers near-duplicate queries and backfills perceptual hashes.
+
+The service keeps the process-wide SimilarityIndex (see core/similarity_index.py) in step with the database: the index
+remembers the last image ID it loaded, and `refresh` adds the images created since then with a keyset query, at most
+once per `refresh_interval`.
+
+`backfill` computes the hashes of images created before hashes were stored, page by page. Those images were loaded
+without a hash, so every `reconcile_interval` the refresh also reads the hashed images updated since its last
+reconcile (keyset over the `updated_at` index, looking back `RECONCILE_LOOKBACK` for transactions that committed late)
+and adds the ones missing from the index. The backfill may run in any process, e.g. backfill_hashes.py.
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from core.exceptions import ImageNotFoundError
+from core.models import SimilarImage
+from core.similarity_index import SimilarityIndex, dhash
+from data.database_context import DatabaseContext
+from data.image_repository import ImageRepositoryInterface
+from service import logger
+
+# How far back each reconcile reads again, so a hash committed after later updates is not skipped
+RECONCILE_LOOKBACK = timedelta(seconds=10)
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """
+    Gets the similarity index of this process, creating it on first use.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SimilarityIndex()
+    return _index
+
+
+class SimilarityService:
+    def __init__(self, image_repo: ImageRepositoryInterface, index: SimilarityIndex, db_context=DatabaseContext,
+                 refresh_interval: float = 1.0, reconcile_interval: float = 30.0, page_size: int = 10000):
+        self.image_repo = image_repo
+        self.index = index
+        self.db_context = db_context
+        self.refresh_interval = refresh_interval
+        self.reconcile_interval = reconcile_interval
+        self.page_size = page_size
+
+    def refresh(self):
+        """
+        Adds the images created since the last refresh to the index.
+        """
+        index = self.index
+        loaded = index.last_refresh is not None
+        if loaded and time.monotonic() - index.last_refresh < self.refresh_interval:
+            return
+        # Once the index is loaded, a refresh that is already running is good enough
+        if not index.refresh_lock.acquire(blocking=not loaded):
+            return
+        try:
+            if not loaded:
+                # Hashes set from here on are picked up by the reconcile
+                with self.db_context(read_only=True) as db:
+                    db.begin_transaction()
+                    index.last_updated_at = self.image_repo.get_last_updated_at()
+                    db.commit_transaction()
+                index.last_reconcile = time.monotonic()
+
+            while True:
+                with self.db_context(read_only=True) as db:
+                    db.begin_transaction()
+                    records = self.image_repo.get_image_records_after(index.last_id, self.page_size)
+                    db.commit_transaction()
+                for record in records:
+                    if record.phash is not None:
+                        index.add(record.guid, record.phash)
+                if records:
+                    index.last_id = records[-1].id
+                if len(records) < self.page_size:
+                    break
+
+            if time.monotonic() - index.last_reconcile >= self.reconcile_interval:
+                self.reconcile()
+            index.last_refresh = time.monotonic()
+        finally:
+            index.refresh_lock.release()
+
+    def reconcile(self):
+        """
+        Adds the images that got their hash after they were loaded into the index, e.g. by a backfill.
+        """
+        index = self.index
+        updated_at = index.last_updated_at - RECONCILE_LOOKBACK if index.last_updated_at is not None else None
+        after_id = 0
+        latest = index.last_updated_at
+        while True:
+            with self.db_context(read_only=True) as db:
+                db.begin_transaction()
+                records = self.image_repo.get_hashed_records_updated_after(updated_at, after_id, index.last_id,
+                                                                           self.page_size)
+                db.commit_transaction()
+            index.add_missing([(record.guid, record.phash) for record in records])
+            if records:
+                updated_at, after_id = records[-1].updated_at, records[-1].id
+                latest = max(latest, updated_at) if latest is not None else updated_at
+            if len(records) < self.page_size:
+                break
+        index.last_updated_at = latest
+        index.last_reconcile = time.monotonic()
+
+    def get_similar_images(self, guid: str, max_distance: int = 10, limit: int = 20) -> List[SimilarImage]:
+        """
+        Gets the images that are near-duplicates of an image.
+
+        Parameters:
+        guid (str): The GUID of the image.
+        max_distance (int): The maximum Hamming distance between the perceptual hashes, out of 64 bits.
+        limit (int): The maximum number of images to return.
+
+        Returns:
+        List[SimilarImage]: The similar images, closest first.
+
+        Raises:
+        ImageNotFoundError: If the image does not exist or has no perceptual hash yet.
+        """
+        self.refresh()
+        image_hash = self.index.get_hash(guid)
+        if image_hash is None:
+            raise ImageNotFoundError(f"No perceptual hash found for GUID {guid}")
+        matches = self.index.query(image_hash, max_distance, limit, exclude_guid=guid)
+
+        similar = []
+        with self.db_context(read_only=True) as db:
+            db.begin_transaction()
+            for match_guid, distance in matches:
+                try:
+                    image = self.image_repo.get_image_details_by_guid(match_guid)
+                except ImageNotFoundError:
+                    continue  # Indexed by a generation that was rolled back
+                similar.append(SimilarImage(**image.model_dump(), distance=distance))
+            db.commit_transaction()
+        return similar
+
+    def find_duplicate(self, image_hash: int, max_distance: int) -> Optional[str]:
+        """
+        Gets the GUID of the closest image within a distance of a hash, if any.
+        """
+        matches = self.index.query(image_hash, max_distance, limit=1)
+        return matches[0][0] if matches else None
+
+    def backfill(self, images_dir: str = 'images', batch_size: int = 500, workers: int = 4) -> Dict:
+        """
+        Computes and stores the perceptual hashes of the images that have none.
+
+        Parameters:
+        images_dir (str): The folder holding the image files.
+        batch_size (int): The number of images hashed and updated per batch.
+        workers (int): The number of threads hashing images.
+
+        Returns:
+        Dict: The number of images hashed, missing on disk and failing to decode.
+        """
+        stats = {"hashed": 0, "missing": 0, "failed": 0}
+        after_id = 0
+
+        def hash_file(filename: str):
+            path = os.path.join(images_dir, filename)
+            if not os.path.isfile(path):
+                return "missing"
+            try:
+                with open(path, 'rb') as f:
+                    return dhash(f.read())
+            except Exception as e:
+                logger.warning(f"Could not hash {path}: {e}")
+                return "failed"
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                with self.db_context(read_only=True) as db:
+                    db.begin_transaction()
+                    records = self.image_repo.get_image_records_after(after_id, batch_size, missing_hash_only=True)
+                    db.commit_transaction()
+                if not records:
+                    break
+                after_id = records[-1].id
+
+                hashes = []
+                for record, result in zip(records, executor.map(hash_file, [record.filename for record in records])):
+                    if isinstance(result, str):
+                        stats[result] += 1
+                    else:
+                        hashes.append((record, result))
+                with self.db_context() as db:
+                    db.begin_transaction()
+                    self.image_repo.update_image_hashes([(record.guid, image_hash) for record, image_hash in hashes])
+                    db.commit_transaction()
+                # Images after the last loaded ID are picked up by the next refresh
+                self.index.add_missing([(record.guid, image_hash) for record, image_hash in hashes
+                                        if record.id <= self.index.last_id])
+                stats["hashed"] += len(hashes)
+        return stats
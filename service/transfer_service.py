@@ -0,0 +1,305 @@
+# service/transfer_service.py
+"""
+This module defines the ImageTransferService, which exports and imports the images of a PixyProxy instance in bulk.
+
+An export is a tar stream. It is built from keyset pages of the `images` table, and for every page it holds one
+metadata member, the image blobs of that page, and one checksums member:
+
+    metadata/00000001.ndjson    one JSON line per image: id, guid, filename, prompt, created_at, size
+    images/<filename>           the image content
+    checksums/00000001.ndjson   one JSON line per image: id, sha256
+    metadata/00000002.ndjson
+    ...
+
+The tar headers are written by hand, so the export is a generator of byte chunks and its memory use does not depend on
+the number or size of the images. Every blob is read once: its SHA-256 is computed while it is streamed, which is why
+the checksums follow the blobs of their page. A file that changes size during the export aborts it.
+
+An import reads the tar stream sequentially and writes the blobs of a page in parallel. Once the checksums of the page
+arrived, it verifies every blob and then inserts the metadata of the page with one multi-row insert, so rows are only
+inserted once their blobs are in place; the blobs of a page that fails verification are removed again. An existing
+file is never overwritten: when a different image already uses the filename, the blob is written under the filename
+with its GUID appended, and the row is inserted with that filename. Both directions are resumable: an export or import
+can be restarted after the last ID it completed, and an import skips blobs that already exist with the same content
+and rows whose GUID already exists.
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import hashlib
+import json
+import os
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import BinaryIO, Callable, Dict, Generator, Iterator, List, Optional, Tuple
+
+from core.exceptions import DataValidationError
+from core.models import ImageRecord
+from data.image_cache import get_image_cache
+from data.database_context import DatabaseContext
+from data.image_repository import ImageRepositoryInterface
+from service import logger
+
+CHUNK_SIZE = 1024 * 1024
+METADATA_DIR = "metadata/"
+CHECKSUMS_DIR = "checksums/"
+IMAGES_DIR = "images/"
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _tar_header(name: str, size: int) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+def _tar_padding(size: int) -> bytes:
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+
+def _check_filename(filename: str):
+    # Filenames come from the archive and must not escape the images folder
+    if not filename or os.path.basename(filename) != filename or filename in (".", ".."):
+        raise DataValidationError(f"Invalid image filename '{filename}' in archive.")
+
+
+class ImageTransferService:
+    def __init__(self, image_repo: ImageRepositoryInterface, images_dir: str = 'images', db_context=DatabaseContext,
+                 batch_size: int = 500, write_workers: int = 8):
+        self.image_repo = image_repo
+        self.images_dir = images_dir
+        self.db_context = db_context
+        self.batch_size = batch_size
+        self.write_workers = write_workers
+
+    def export_archive(self, after_id: int = 0) -> Iterator[bytes]:
+        """
+        Exports the images with an ID larger than `after_id` as a tar stream.
+
+        Parameters:
+        after_id (int): Resume the export after this ID, i.e. the last ID of the last complete page.
+
+        Returns:
+        Iterator[bytes]: The chunks of the tar stream.
+        """
+        page = 0
+        while True:
+            # The DB context is closed before anything is yielded, so no connection is held while the client reads
+            with self.db_context(read_only=True) as db:
+                db.begin_transaction()
+                records = self.image_repo.get_image_records_after(after_id, self.batch_size)
+                db.commit_transaction()
+            if not records:
+                break
+            after_id = records[-1].id
+            page += 1
+
+            lines = []
+            blobs = []
+            for record in records:
+                path = os.path.join(self.images_dir, record.filename)
+                if not os.path.isfile(path):
+                    logger.warning(f"Skipping image {record.guid} in export, no file found at {path}")
+                    continue
+                entry = record.model_dump(mode="json")
+                entry.update(size=os.path.getsize(path))
+                lines.append(json.dumps(entry) + "\n")
+                blobs.append((path, entry))
+
+            yield from self._export_member(f"{METADATA_DIR}{page:08d}.ndjson", "".join(lines))
+            checksums = []
+            for path, entry in blobs:
+                sha256 = yield from self._export_blob(path, entry)
+                checksums.append(json.dumps({"id": entry["id"], "sha256": sha256}) + "\n")
+            yield from self._export_member(f"{CHECKSUMS_DIR}{page:08d}.ndjson", "".join(checksums))
+
+        # End of archive: two zero blocks, padded to a full tar record
+        yield b"\0" * tarfile.RECORDSIZE
+
+    @staticmethod
+    def _export_member(name: str, text: str) -> Iterator[bytes]:
+        content = text.encode("utf-8")
+        yield _tar_header(name, len(content))
+        yield content + _tar_padding(len(content))
+
+    @staticmethod
+    def _export_blob(path: str, entry: Dict) -> Generator[bytes, None, str]:
+        # Streams the blob and returns its SHA-256
+        yield _tar_header(f"{IMAGES_DIR}{entry['filename']}", entry['size'])
+        digest = hashlib.sha256()
+        remaining = entry['size']
+        with open(path, 'rb') as f:
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+                yield chunk
+            changed = remaining or os.fstat(f.fileno()).st_size != entry['size']
+        if changed:
+            raise DataValidationError(f"Image file {path} changed during the export.")
+        yield _tar_padding(entry['size'])
+        return digest.hexdigest()
+
+    def import_archive(self, stream: BinaryIO, after_id: int = 0,
+                       checkpoint: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Imports the images of a tar stream produced by `export_archive`.
+
+        Parameters:
+        stream (BinaryIO): The tar stream, read sequentially.
+        after_id (int): Resume the import after this source ID, i.e. the `last_id` of an interrupted import.
+        checkpoint (Callable[[Dict], None]): Called with the stats after every completed page, e.g. to persist
+            `last_id` as the resume point.
+
+        Returns:
+        Dict: The number of images created, skipped and written, and the last source ID that was completed.
+
+        Raises:
+        DataValidationError: If the archive is malformed or a blob does not match its checksum.
+        """
+        os.makedirs(self.images_dir, exist_ok=True)
+        stats = {"created": 0, "skipped": 0, "blobs_written": 0, "blobs_skipped": 0, "blobs_renamed": 0,
+                 "last_id": after_id}
+        pending: Dict[str, Dict] = {}
+        page: List[Dict] = []
+        digests: Dict[int, str] = {}  # The SHA-256 of every blob received for the page, by source ID
+        writes = []
+        written: List[str] = []  # The files written for the page, removed again if it fails
+
+        with ThreadPoolExecutor(max_workers=self.write_workers) as executor:
+            def complete_page():
+                wait(writes)
+                try:
+                    for write in writes:
+                        stats["blobs_written"] += write.result()
+                    if pending:
+                        missing = ", ".join(sorted(pending))
+                        raise DataValidationError(f"Archive is missing the image files {missing}.")
+                    for entry in page:
+                        if "sha256" not in entry:
+                            raise DataValidationError(f"Archive is missing the checksum of {entry['filename']}.")
+                        if digests[entry["id"]] != entry["sha256"]:
+                            raise DataValidationError(f"Image file {entry['filename']} does not match its checksum.")
+                except Exception:
+                    for path in written:
+                        if os.path.exists(path):
+                            os.remove(path)
+                    raise
+                finally:
+                    writes.clear()
+                    written.clear()
+                    digests.clear()
+
+                if page:
+                    records = [ImageRecord(**entry) for entry in page]
+                    with self.db_context() as db:
+                        db.begin_transaction()
+                        created = self.image_repo.create_images(records)
+                        db.commit_transaction()
+                    stats["created"] += created
+                    stats["skipped"] += len(records) - created
+                    stats["last_id"] = max(entry["id"] for entry in page)
+                    page.clear()
+                    logger.info(f"Imported {stats['created']} images, resume point is source ID {stats['last_id']}")
+                    if checkpoint is not None:
+                        checkpoint(dict(stats))
+
+            try:
+                archive = tarfile.open(fileobj=stream, mode="r|")
+            except tarfile.TarError as e:
+                raise DataValidationError(f"Invalid export archive: {e}") from e
+
+            with archive:
+                for member in archive:
+                    if member.name.startswith(METADATA_DIR):
+                        complete_page()
+                        for entry in self._read_lines(archive, member):
+                            _check_filename(entry["filename"])
+                            if entry["id"] <= after_id:
+                                continue
+                            page.append(entry)
+                            pending[entry["filename"]] = entry
+                    elif member.name.startswith(CHECKSUMS_DIR):
+                        entries = {entry["id"]: entry for entry in page}
+                        for checksum in self._read_lines(archive, member):
+                            if checksum["id"] in entries:
+                                entries[checksum["id"]]["sha256"] = checksum["sha256"]
+                        complete_page()
+                    elif member.name.startswith(IMAGES_DIR) and member.isfile():
+                        entry = pending.pop(member.name[len(IMAGES_DIR):], None)
+                        if entry is None:
+                            continue  # Already imported before the resume point
+                        if member.size != entry["size"]:
+                            raise DataValidationError(f"Image file {entry['filename']} has an unexpected size.")
+                        content = archive.extractfile(member).read()
+                        digests[entry["id"]] = hashlib.sha256(content).hexdigest()
+                        filename, exists = self._local_filename(entry, digests[entry["id"]])
+                        if filename != entry["filename"]:
+                            logger.warning(f"Image file {entry['filename']} already exists with different content, "
+                                           f"importing image {entry['guid']} as {filename}")
+                            entry["filename"] = filename
+                            stats["blobs_renamed"] += 1
+                        if exists:
+                            stats["blobs_skipped"] += 1
+                            continue
+                        written.append(os.path.join(self.images_dir, filename))
+                        writes.append(executor.submit(self._write_blob, filename, content))
+                        # Bound the number of blobs held in memory
+                        if len(writes) >= 2 * self.write_workers:
+                            stats["blobs_written"] += writes.pop(0).result()
+                complete_page()
+
+        return stats
+
+    @staticmethod
+    def _read_lines(archive: tarfile.TarFile, member: tarfile.TarInfo) -> List[Dict]:
+        return [json.loads(line) for line in archive.extractfile(member).read().decode("utf-8").splitlines()]
+
+    def _local_filename(self, entry: Dict, sha256: str) -> Tuple[str, bool]:
+        """
+        Picks the local file of an imported blob: its own filename, or its filename with the GUID appended when a
+        different image already uses that name. Existing files are never overwritten.
+
+        Parameters:
+        entry (Dict): The metadata of the image.
+        sha256 (str): The SHA-256 of the blob.
+
+        Returns:
+        Tuple[str, bool]: The filename, and whether a file with the same content already exists under it.
+
+        Raises:
+        DataValidationError: If both filenames are used by different images.
+        """
+        name, extension = os.path.splitext(entry["filename"])
+        for filename in (entry["filename"], f"{name}_{entry['guid']}{extension}"):
+            _check_filename(filename)
+            path = os.path.join(self.images_dir, filename)
+            if not os.path.exists(path):
+                return filename, False
+            if os.path.getsize(path) == entry["size"] and _sha256_file(path) == sha256:
+                return filename, True
+        raise DataValidationError(f"Image file {entry['filename']} of image {entry['guid']} conflicts with "
+                                  f"existing images of the same name.")
+
+    def _write_blob(self, filename: str, content: bytes) -> int:
+        path = os.path.join(self.images_dir, filename)
+        # Write to a temporary file first, so an interrupted import never leaves a partial image behind
+        with open(path + ".part", 'wb') as f:
+            f.write(content)
+        os.replace(path + ".part", path)
+        # Content may still be cached under the name of a file that was deleted locally
+        get_image_cache().invalidate(filename)
+        return 1
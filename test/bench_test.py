@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from bench.run import compare, run
+from bench.stats import percentile
+from core.exceptions import ImageNotFoundError
+from data.image_repository import InMemoryImageRepository
+
+
+# This test function checks that the in-memory repository stores and returns image details.
+def test_in_memory_repository():
+    repo = InMemoryImageRepository()
+    created = repo.create_image("a rubber duck on a sink", "abc123", "duck.png")
+    assert repo.get_image_details_by_guid("abc123") == created
+    assert repo.get_all_image_details() == [created]
+    with pytest.raises(ImageNotFoundError):
+        repo.get_image_details_by_guid("missing")
+
+
+# This test function checks the nearest-rank percentiles.
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 95) == 0.0
+
+
+# This test function checks that slower results are reported as regressions against a baseline.
+def test_compare_reports_regressions():
+    baseline = {"workloads": {"lookup": {"throughput_rps": 100, "p95_ms": 10, "p99_ms": 20, "errors": 0}}}
+    same = {"workloads": {"lookup": {"throughput_rps": 95, "p95_ms": 11, "p99_ms": 21, "errors": 0}}}
+    slower = {"workloads": {"lookup": {"throughput_rps": 50, "p95_ms": 30, "p99_ms": 20, "errors": 0}}}
+    assert compare(same, baseline, tolerance=0.15) == []
+    assert len(compare(slower, baseline, tolerance=0.15)) == 2
+
+
+# This test function runs every workload against the in-process app with the fake upstream.
+def test_run_all_workloads_locally(monkeypatch):
+    monkeypatch.delenv("WARMUP_ON_STARTUP", raising=False)
+    results = run(["lookup", "list", "content", "generate", "mixed"], requests=10, concurrency=4, seed_images=5)
+    for name, summary in results["workloads"].items():
+        assert summary["requests"] == 10, name
+        assert summary["statuses"] == {"200": 10}, name
+        assert summary["p50_ms"] <= summary["p99_ms"]
+    # The in-process target does not leak its settings into the environment
+    assert "WARMUP_ON_STARTUP" not in os.environ
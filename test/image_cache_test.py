@@ -0,0 +1,76 @@
+import data
+import data.image_cache
+from data.image_cache import ImageContentCache, get_image_cache
+from data.image_repository import read_image_file
+
+
+# This test function checks that the cache is bounded by bytes and evicts the least recently used images.
+def test_cache_is_bounded_by_bytes():
+    cache = ImageContentCache(max_bytes=300, max_entry_bytes=100)
+    for name in ("a", "b", "c"):
+        assert cache.put(name, b"x" * 100, force=True)
+    assert cache.get("a") is not None  # "b" is now the least recently used
+    assert cache.put("d", b"x" * 100, force=True)
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert stats["bytes"] == 300
+    assert stats["entries"] == 3
+    assert stats["evictions"] == 1
+
+
+# This test function checks that a rarely requested large image cannot flush small hot ones,
+# and that images above the entry limit are never cached.
+def test_admission_protects_hot_images():
+    cache = ImageContentCache(max_bytes=400, max_entry_bytes=300)
+    for name in ("a", "b", "c", "d"):
+        cache.put(name, b"x" * 100, force=True)
+        for _ in range(5):
+            cache.get(name)
+    assert not cache.put("huge", b"x" * 300)
+    assert not cache.put("too_big", b"x" * 301, force=True)
+    assert all(cache.get(name) is not None for name in ("a", "b", "c", "d"))
+    assert cache.stats()["rejections"] == 2
+
+
+# This test function checks the hit ratio metric.
+def test_hit_ratio():
+    cache = ImageContentCache(max_bytes=1000)
+    cache.put("a", b"x" * 10)
+    cache.get("a")
+    cache.get("missing")
+    assert cache.stats()["hit_ratio"] == 0.5
+
+
+# This test function checks that a rejected offer of an image that is already cached keeps the cached image.
+def test_rejected_put_keeps_existing_entry():
+    cache = ImageContentCache(max_bytes=200, max_entry_bytes=200)
+    cache.put("a", b"x" * 100, force=True)
+    cache.put("b", b"y" * 100, force=True)
+    for _ in range(5):
+        cache.get("b")
+    assert not cache.put("a", b"z" * 150)
+    assert cache.get("a") == b"x" * 100
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] == 200
+
+
+# This test function checks that image reads go through the cache.
+def test_read_image_file_uses_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(data.image_cache, "_image_cache", ImageContentCache(max_bytes=1000))
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "duck.png").write_bytes(b"duck")
+
+    assert read_image_file("duck.png") == b"duck"
+    (tmp_path / "images" / "duck.png").unlink()
+    assert read_image_file("duck.png") == b"duck"  # Served from memory
+    assert data.image_cache.get_image_cache().stats()["hits"] == 1
+
+
+# This test function checks that the cache is sized once the configuration is loaded, so that IMAGE_CACHE_BYTES
+# can be set in the .env file.
+def test_cache_is_sized_after_loading_config(monkeypatch):
+    monkeypatch.delenv("IMAGE_CACHE_BYTES", raising=False)
+    monkeypatch.setattr(data, "get_config", lambda: monkeypatch.setenv("IMAGE_CACHE_BYTES", "1234"))
+    monkeypatch.setattr(data.image_cache, "_image_cache", None)
+    assert get_image_cache().max_bytes == 1234
@@ -0,0 +1,27 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from bench.import_time import measure_import
+from core.exceptions import DBConnectionError
+
+
+# This test function checks that importing the app neither connects to the database nor
+# loads the openai SDK, so worker spawns and test collection stay cheap.
+def test_import_main_is_lazy():
+    result = measure_import("main")
+    assert result["total_ms"] > 0
+    assert result["lazy_modules_loaded"] == []
+
+
+# This test function checks that the startup DB check still fails fast with the warm-up turned off.
+def test_startup_db_check_without_warmup(monkeypatch):
+    import main
+
+    def unreachable():
+        raise DBConnectionError()
+
+    monkeypatch.setenv("WARMUP_ON_STARTUP", "false")
+    monkeypatch.setattr(main, "check_db_pool", unreachable)
+    with pytest.raises(DBConnectionError):
+        with TestClient(main.app):
+            pass
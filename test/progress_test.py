@@ -0,0 +1,184 @@
+import asyncio
+import json
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from core.models import ImageDetail, ImageDetailCreate
+from data.replica_router import ReplicaRouter
+from service.generation_progress import GenerationEvent, GenerationProgress, Subscription
+from service.generation_scheduler import GenerationScheduler
+
+
+class FakeImageService:
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def create_image(self, image: ImageDetailCreate, progress=None) -> ImageDetail:
+        self.calls += 1
+        self.release.wait(5)
+        progress("upstream-complete", bytes=3)
+        progress("stored", guid="guid1")
+        return ImageDetail(prompt=image.prompt, guid="guid1", filename="duck.png")
+
+
+async def collect(progress: GenerationProgress, run):
+    subscription = progress.subscribe(run)
+    names = []
+    while True:
+        event = await subscription.next(timeout=5)
+        names.append((event.name, event.data))
+        if event.name in ("done", "error"):
+            progress.unsubscribe(run, subscription)
+            return names
+
+
+# This test function checks the lifecycle events and their fan-out to the subscribers of a prompt,
+# and that every request still gets a generation of its own.
+def test_events_fan_out_to_subscribers_of_a_prompt():
+    async def scenario():
+        scheduler = GenerationScheduler(concurrency=1)
+        progress = GenerationProgress(scheduler, position_interval=0.01)
+        service = FakeImageService()
+        blocker = await scheduler.acquire("other")
+
+        run = progress.start(ImageDetailCreate(prompt="a duck"), service, "client-a")
+        subscribers = [asyncio.create_task(collect(progress, progress.get_run("a duck"))) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        assert progress.stats() == {"in_progress": 1, "subscribers": 3, "dropped_events": 0}
+
+        scheduler.release(blocker)
+        await asyncio.sleep(0.05)
+        service.release.set()
+        events = await asyncio.gather(*subscribers)
+        await run.future
+
+        # The same prompt again is a new generation, queued for its own client
+        again = await progress.generate(ImageDetailCreate(prompt="a duck"), service, "client-b")
+        return service, again, events, progress.stats(), scheduler.stats()
+
+    service, image, events, stats, scheduler_stats = asyncio.run(scenario())
+    assert service.calls == 2
+    assert image.guid == "guid1"
+    assert all(received == events[0] for received in events)
+    assert [name for name, _ in events[0]] == ["queued", "queued", "started", "upstream-complete", "stored", "done"]
+    assert events[0][0][1] == {"position": 1} and events[0][1][1] == {"position": 0}
+    assert events[0][-1][1] == {"prompt": "a duck", "guid": "guid1", "filename": "duck.png"}
+    assert stats["in_progress"] == 0
+    assert scheduler_stats["classes"]["interactive"]["dispatched"] == 3  # including the blocker
+
+
+# This test function checks that a generation stays available to subscribers of its prompt when a later
+# generation of the same prompt completes first.
+def test_run_of_prompt_outlives_later_run():
+    async def scenario():
+        progress = GenerationProgress(GenerationScheduler(concurrency=2))
+        slow, fast = FakeImageService(), FakeImageService()
+        first = progress.start(ImageDetailCreate(prompt="a duck"), slow, "client-a")
+        second = progress.start(ImageDetailCreate(prompt="a duck"), fast, "client-b")
+        assert progress.get_run("a duck") is second
+
+        fast.release.set()
+        await second.future
+        assert progress.get_run("a duck") is first
+
+        slow.release.set()
+        await first.future
+        return progress.get_run("a duck")
+
+    assert asyncio.run(scenario()) is None
+
+
+# This test function checks that a slow subscriber drops its oldest events and keeps the latest ones.
+def test_slow_subscriber_backpressure():
+    async def scenario():
+        subscription = Subscription(max_pending=2)
+        assert await subscription.next(timeout=0.01) is None  # Nothing yet: the caller sends a heartbeat
+        for position in (3, 2, 1, 0):
+            subscription.push(GenerationEvent("queued", {"position": position}))
+        subscription.push(GenerationEvent("done", {}))
+        return [(await subscription.next(timeout=0.01)) for _ in range(2)], subscription.dropped
+
+    events, dropped = asyncio.run(scenario())
+    assert [(event.name, event.data) for event in events] == [("queued", {"position": 0}), ("done", {})]
+    assert dropped == 3
+
+
+# This test function checks the Server-Sent Events stream of the generation route.
+def test_stream_route(monkeypatch):
+    monkeypatch.setenv("WARMUP_ON_STARTUP", "false")
+    monkeypatch.setenv("DB_CHECK_ON_STARTUP", "false")
+    from main import app
+    from service.generation_progress import get_generation_progress
+    from web.dependencies import get_image_service
+
+    service = FakeImageService()
+    service.release.set()
+    app.dependency_overrides[get_image_service] = lambda: service
+    app.dependency_overrides[get_generation_progress] = lambda: GenerationProgress(GenerationScheduler(concurrency=1))
+    try:
+        with TestClient(app) as client:
+            with client.stream("POST", "/image/stream", json={"prompt": "a duck"}) as response:
+                assert response.headers["content-type"].startswith("text/event-stream")
+                body = response.read().decode()
+            missing = client.get("/image/stream", params={"prompt": "a duck"})
+    finally:
+        app.dependency_overrides.clear()
+
+    blocks = [block.split("\n") for block in body.strip().split("\n\n")]
+    assert [lines[0] for lines in blocks] == ["event: queued", "event: started", "event: upstream-complete",
+                                             "event: stored", "event: done"]
+    assert json.loads(blocks[-1][1][len("data: "):])["guid"] == "guid1"
+    assert missing.status_code == 404
+
+
+# This test function checks that the done event of a stream carries the time of its write, which the
+# read-your-writes headers cannot, as they were sent before the image was stored.
+def test_stream_done_event_carries_last_write(monkeypatch):
+    monkeypatch.setenv("WARMUP_ON_STARTUP", "false")
+    monkeypatch.setenv("DB_CHECK_ON_STARTUP", "false")
+    from main import app
+    from service.generation_progress import get_generation_progress
+    from web.dependencies import get_image_service
+
+    class StoringImageService(FakeImageService):
+        def create_image(self, image: ImageDetailCreate, progress=None) -> ImageDetail:
+            ReplicaRouter(None, {}).record_write(None)  # As the repository does when it inserts the row
+            return super().create_image(image, progress)
+
+    service = StoringImageService()
+    service.release.set()
+    app.dependency_overrides[get_image_service] = lambda: service
+    app.dependency_overrides[get_generation_progress] = lambda: GenerationProgress(GenerationScheduler(concurrency=1))
+    try:
+        with TestClient(app) as client:
+            with client.stream("POST", "/image/stream", json={"prompt": "a duck"}) as response:
+                body = response.read().decode()
+    finally:
+        app.dependency_overrides.clear()
+
+    assert "x-last-write" not in response.headers
+    done = json.loads(body.strip().split("\n\n")[-1].split("\n")[1][len("data: "):])
+    assert done["guid"] == "guid1"
+    assert time.time() - 5 < float(done["last_write"]) <= time.time()
+
+
+# This test function checks that a stream receives the events published between the route returning
+# and the response starting to stream.
+def test_stream_subscribes_before_streaming():
+    from web.event_stream import event_stream_response
+
+    async def scenario():
+        progress = GenerationProgress(GenerationScheduler(concurrency=1))
+        service = FakeImageService()
+        service.release.set()
+        run = progress.start(ImageDetailCreate(prompt="a duck"), service, "client-a")
+        response = event_stream_response(progress, run, heartbeat=5)
+        await run.future  # The whole generation happens before the body is iterated
+        return [chunk async for chunk in response.body_iterator]
+
+    chunks = asyncio.run(scenario())
+    assert [chunk.split(b"\n")[0] for chunk in chunks] == [b"event: queued", b"event: started",
+                                                          b"event: upstream-complete", b"event: stored", b"event: done"]
@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from bench.replay import merge_captures, replay
+from bench.run import local_target
+from bench.fake_upstream import FakeUpstreamConfig
+from web.middleware import LoggingMiddleware
+from web.request_capture import RequestCapture
+
+
+# This test function checks that the logging middleware appends an anonymized record per request.
+def test_capture_records_requests(tmp_path):
+    capture = RequestCapture(str(tmp_path / "capture.jsonl"), anonymize=True, salt="test")
+    app = FastAPI()
+    app.add_middleware(LoggingMiddleware, capture=capture)
+
+    @app.get("/image/{guid}")
+    def get_image(guid: str):
+        return {"guid": guid}
+
+    with TestClient(app) as client:
+        assert client.get("/image/abc123").status_code == 200
+    capture.close()
+
+    records = list(merge_captures([capture.path]))
+    assert len(records) == 1
+    record = records[0]
+    assert record["method"] == "GET"
+    assert record["route"] == "/image/{guid}"
+    assert record["status"] == 200
+    assert record["response_bytes"] > 0
+    assert record["guid"] == capture.anonymize_guid("abc123")
+    assert "abc123" not in json.dumps(record)
+
+
+# This test function checks that the capture of the app is configured on the first request, so that
+# CAPTURE_FILE can be set in the .env file, which is only loaded with the configuration.
+def test_capture_configured_from_dotenv(tmp_path, monkeypatch):
+    import data
+
+    path = str(tmp_path / "capture.jsonl")
+    monkeypatch.delenv("CAPTURE_FILE", raising=False)
+    monkeypatch.setattr(data, "get_config", lambda: monkeypatch.setenv("CAPTURE_FILE", path))
+    app = FastAPI()
+    app.add_middleware(LoggingMiddleware, capture_factory=RequestCapture.from_env)
+
+    @app.get("/image/")
+    def get_images():
+        return []
+
+    with TestClient(app) as client:
+        assert client.get("/image/").status_code == 200
+    assert [record["route"] for record in merge_captures([path])] == ["/image/"]
+
+
+# This test function replays a small capture at 10x against the in-process app and checks the report.
+def test_replay_against_local_target():
+    records = [
+        {"ts": 1000.0, "method": "GET", "route": "/image/", "path": "/image/", "guid": None, "status": 200},
+        {"ts": 1000.1, "method": "GET", "route": "/image/{guid}", "path": "/image/x", "guid": "x", "status": 200},
+        {"ts": 1000.2, "method": "GET", "route": "/image/{guid}/content", "path": "/image/y/content", "guid": "y", "status": 500},
+        {"ts": 1000.3, "method": "POST", "route": "/image/", "path": "/image/", "guid": None, "status": 200},
+    ]
+    with local_target(seed_images=3, upstream=FakeUpstreamConfig(latency_ms=5)) as (base_url, guids):
+        report = asyncio.run(replay(records, base_url, speed=10, concurrency=4))
+
+    assert sum(route["requests"] for route in report["routes"].values()) == 4
+    assert report["routes"]["GET /image/{guid}"]["statuses"] == {"200": 1}
+    assert report["status_divergence"] == {"GET /image/{guid}/content": {"500->200": 1}}
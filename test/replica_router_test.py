@@ -0,0 +1,124 @@
+import os
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from data.replica_router import PRIMARY, ReplicaRouter, WriteSession, write_session
+from web.middleware import ReadYourWritesMiddleware
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, name, available=True):
+        self.name = name
+        self.available = available
+
+    def get_connection(self):
+        if not self.available:
+            raise ConnectionError(f"{self.name} is down")
+        return FakeConnection(self)
+
+
+def make_router(lags, **kwargs):
+    replicas = {name: FakePool(name) for name in lags}
+    router = ReplicaRouter(FakePool(PRIMARY), replicas, lag_probe=lambda conn: lags[conn.pool.name], **kwargs)
+    router.check_health()
+    return router
+
+
+# This test function checks that writes go to the primary and reads to the replica with the fewest connections.
+def test_reads_use_least_connections_replica():
+    router = make_router({"r1": 0.0, "r2": 0.0})
+    assert router.acquire(read_only=False)[1] == PRIMARY
+    first = router.acquire(read_only=True)[1]
+    second = router.acquire(read_only=True)[1]
+    assert {first, second} == {"r1", "r2"}
+    router.release(first)
+    assert router.acquire(read_only=True)[1] == first
+
+
+# This test function checks that reads of a client stick to the primary right after it wrote.
+def test_read_your_writes():
+    router = make_router({"r1": 0.0}, sticky_seconds=60)
+    router.record_write("client-a")
+    assert router.acquire(read_only=True, client_id="client-a")[1] == PRIMARY
+    assert router.acquire(read_only=True, client_id="client-b")[1] == "r1"
+
+
+# This test function checks that a write the client made through another worker process, as carried
+# in its request, also makes its reads stick to the primary.
+def test_read_your_writes_across_workers():
+    router = make_router({"r1": 0.0}, sticky_seconds=5)
+    token = write_session.set(WriteSession(last_write=time.time() - 1))
+    try:
+        assert router.acquire(read_only=True, client_id="client-a")[1] == PRIMARY
+    finally:
+        write_session.reset(token)
+    token = write_session.set(WriteSession(last_write=time.time() - 60))
+    try:
+        assert router.acquire(read_only=True, client_id="client-a")[1] == "r1"
+    finally:
+        write_session.reset(token)
+
+
+# This test function checks that the middleware hands the time of a write back to the client and reads it again.
+def test_read_your_writes_middleware():
+    router = make_router({"r1": 0.0}, sticky_seconds=5)
+    app = FastAPI()
+    app.add_middleware(ReadYourWritesMiddleware)
+
+    @app.post("/write")
+    def write():
+        router.record_write(None)
+
+    @app.get("/read")
+    def read():
+        return router.acquire(read_only=True)[1]
+
+    client = TestClient(app)
+    assert client.get("/read").json() == "r1"
+    response = client.post("/write")
+    assert float(response.headers["x-last-write"]) <= time.time()
+    assert client.get("/read").json() == PRIMARY  # The cookie is sent back
+    assert TestClient(app).get("/read", headers={"x-last-write": response.headers["x-last-write"]}).json() == PRIMARY
+
+
+# This test function checks that lagging or unreachable replicas fall back to the primary.
+def test_fallback_to_primary():
+    router = make_router({"r1": 30.0}, max_lag_seconds=5)
+    assert router.acquire(read_only=True)[1] == PRIMARY
+
+    router = make_router({"r1": 0.0})
+    router.replica_pools["r1"].available = False
+    assert router.acquire(read_only=True)[1] == PRIMARY
+    assert router.stats()["replicas"]["r1"]["healthy"] is False
+
+
+# This test function routes real database contexts between two local MySQL instances. The second instance
+# (DB_REPLICA_HOSTS, e.g. localhost:3307) needs the same schema; it is treated as a caught-up replica.
+@pytest.mark.skipif(not os.getenv("DB_REPLICA_HOSTS"), reason="needs a second local MySQL instance in DB_REPLICA_HOSTS")
+def test_routing_with_two_local_instances(monkeypatch):
+    import data
+    from data.database_context import DatabaseContext
+
+    router = data.get_replica_router()
+    monkeypatch.setattr(router, "lag_probe", lambda conn: 0.0)
+    router.check_health()
+
+    with DatabaseContext(client_id="writer") as db:
+        assert db.pool_name == PRIMARY
+    with DatabaseContext(read_only=True, client_id="writer") as db:
+        assert db.pool_name == PRIMARY
+    with DatabaseContext(read_only=True, client_id="reader") as db:
+        assert db.pool_name != PRIMARY
+        db.cursor.execute("SELECT COUNT(*) AS count FROM images")
+        assert db.cursor.fetchone()["count"] >= 0
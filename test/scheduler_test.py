@@ -0,0 +1,153 @@
+import asyncio
+import threading
+
+import pytest
+
+from anyio import to_thread
+from fastapi.concurrency import run_in_threadpool
+
+from core.exceptions import TooManyRequestsError
+from core.models import ImageDetail, ImageDetailCreate
+from service import generation_scheduler
+from service.generation_progress import GenerationProgress
+from service.generation_scheduler import BATCH, INTERACTIVE, GenerationScheduler, get_generation_scheduler
+
+
+async def grant_order(scheduler: GenerationScheduler, requests):
+    """
+    Queues the (client, priority) requests behind a blocking generation, then completes the generations one by one
+    and returns the requests in the order they were started.
+    """
+    blocker = await scheduler.acquire("blocker", BATCH)
+    order = []
+
+    async def run(client_id, priority):
+        ticket = await scheduler.acquire(client_id, priority)
+        order.append((client_id, priority))
+        await asyncio.sleep(0)
+        scheduler.release(ticket)
+
+    tasks = [asyncio.create_task(run(*request)) for request in requests]
+    await asyncio.sleep(0)
+    scheduler.release(blocker)
+    await asyncio.gather(*tasks)
+    return order
+
+
+# This test function checks that an interactive request does not wait behind a batch backlog.
+def test_interactive_ahead_of_batch():
+    scheduler = GenerationScheduler(concurrency=1)
+    requests = [("bulk", BATCH)] * 20 + [("user", INTERACTIVE)] * 2
+    order = asyncio.run(grant_order(scheduler, requests))
+    assert order.index(("user", INTERACTIVE)) <= 1
+    assert order[:4].count(("user", INTERACTIVE)) == 2
+    assert scheduler.stats()["classes"][BATCH]["dispatched"] == 21  # including the blocker
+
+
+# This test function checks that clients of a class share the slots by their weights, whatever their queue length.
+def test_weighted_fair_share_between_clients():
+    scheduler = GenerationScheduler(concurrency=1, client_weights={"gold": 2.0})
+    requests = [("gold", INTERACTIVE)] * 30 + [("free", INTERACTIVE)] * 30 + [("late", INTERACTIVE)] * 3
+    order = [client_id for client_id, _ in asyncio.run(grant_order(scheduler, requests))]
+    # A client with a weight of 2 gets twice the slots, and a client with only a few requests is not starved
+    assert order[:30].count("gold") == 2 * order[:30].count("free")
+    assert [i for i, client_id in enumerate(order) if client_id == "late"] == [2, 6, 10]
+
+
+# This test function checks the per-client concurrency cap and the queue limit.
+def test_client_concurrency_cap_and_queue_limit():
+    async def scenario():
+        scheduler = GenerationScheduler(concurrency=4, client_concurrency=2, max_queued_per_client=2)
+        held = [await scheduler.acquire("a"), await scheduler.acquire("a")]
+        waiting = [asyncio.create_task(scheduler.acquire("a")) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert scheduler.stats()["running"] == 2
+        with pytest.raises(TooManyRequestsError):
+            await scheduler.acquire("a")
+
+        # Another client still gets the free slots
+        other = await asyncio.wait_for(scheduler.acquire("b"), timeout=1)
+
+        # A cancelled waiter leaves the queue, the other one starts when a slot of its client frees up
+        waiting[0].cancel()
+        await asyncio.gather(waiting[0], return_exceptions=True)
+        assert scheduler.stats()["classes"][INTERACTIVE]["queued"] == 1
+        scheduler.release(held[0])
+        ticket = await asyncio.wait_for(waiting[1], timeout=1)
+        for done in (held[1], other, ticket):
+            scheduler.release(done)
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["running"] == 0
+    assert stats["queued_clients"] == 0
+    assert stats["classes"][INTERACTIVE]["dispatched"] == 4
+    assert stats["classes"][INTERACTIVE]["wait_seconds"]["max"] > 0
+
+
+# This test function checks that by default generations leave threads and DB connections free for reads,
+# even when they fill every generation slot.
+def test_reads_served_while_generations_fill_every_slot(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "4")
+    monkeypatch.delenv("THREADPOOL_SIZE", raising=False)
+    monkeypatch.delenv("GENERATION_CONCURRENCY", raising=False)
+    monkeypatch.setattr(generation_scheduler, "_scheduler", None)
+    release = threading.Event()
+
+    class BlockingImageService:
+        def create_image(self, image: ImageDetailCreate, progress=None) -> ImageDetail:
+            release.wait(5)
+            return ImageDetail(prompt=image.prompt, guid="guid1", filename="duck.png")
+
+    async def scenario():
+        limiter = to_thread.current_default_thread_limiter()
+        limiter.total_tokens = 4  # The threadpool size the lifespan sets for a pool of 4
+        scheduler = get_generation_scheduler()
+        progress = GenerationProgress(scheduler)
+        runs = [progress.start(ImageDetailCreate(prompt=f"duck {i}"), BlockingImageService(), f"client{i}")
+                for i in range(6)]
+        while limiter.borrowed_tokens < scheduler.concurrency:
+            await asyncio.sleep(0.01)
+        assert scheduler.stats()["running"] == scheduler.concurrency == 2
+
+        reads = [run_in_threadpool(lambda: "read") for _ in range(2)]
+        try:
+            assert await asyncio.wait_for(asyncio.gather(*reads), timeout=2) == ["read", "read"]
+        finally:
+            release.set()
+        await asyncio.gather(*(run.future for run in runs))
+
+    asyncio.run(scenario())
+    monkeypatch.setattr(generation_scheduler, "_scheduler", None)
+
+
+# This test function checks that the metrics route reads the scheduler stats, and resolves the replica router
+# (which may connect to the replicas) off the event loop.
+def test_metrics_route(monkeypatch):
+    monkeypatch.setenv("WARMUP_ON_STARTUP", "false")
+    monkeypatch.setenv("DB_CHECK_ON_STARTUP", "false")
+    from fastapi.testclient import TestClient
+
+    from main import app
+    from web.routers import metrics_router
+
+    calls = []
+
+    def blocking_replica_router():
+        try:
+            asyncio.get_running_loop()
+            calls.append("event loop")
+        except RuntimeError:
+            calls.append("thread")
+        return None
+
+    monkeypatch.setattr(metrics_router, "get_replica_router", blocking_replica_router)
+    app.dependency_overrides[metrics_router.get_generation_scheduler] = lambda: GenerationScheduler(concurrency=3)
+    try:
+        with TestClient(app) as client:
+            metrics = client.get("/metrics/").json()
+    finally:
+        app.dependency_overrides.clear()
+    assert calls == ["thread"]
+    assert metrics["generation"]["concurrency"] == 3
+    assert set(metrics["generation"]["classes"]) == {INTERACTIVE, BATCH}
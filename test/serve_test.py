@@ -0,0 +1,36 @@
+import pytest
+
+from data import get_pool_size
+from serve import MAX_POOL_SIZE, compute_worker_resources
+
+
+# This test function checks that the DB connection budget is divided across the workers
+# so that all workers together never exceed it.
+def test_budget_is_divided_across_workers():
+    pool_size, threads = compute_worker_resources(workers=4, db_connection_budget=100)
+    assert pool_size == 25
+    assert threads == 25
+    assert pool_size * 4 <= 100
+
+
+# This test function checks that the threadpool is never larger than the DB pool of a worker.
+def test_threads_are_capped_at_pool_size():
+    assert compute_worker_resources(workers=3, db_connection_budget=20, threads_per_worker=40) == (6, 6)
+    assert compute_worker_resources(workers=3, db_connection_budget=20, threads_per_worker=2) == (6, 2)
+
+
+# This test function checks that a budget too small for the number of workers is rejected.
+def test_budget_too_small_is_rejected():
+    with pytest.raises(ValueError):
+        compute_worker_resources(workers=8, db_connection_budget=4)
+
+
+# This test function checks that the pool of a worker never exceeds what mysql-connector accepts,
+# and that an invalid DB_POOL_SIZE is rejected with a clear error.
+def test_pool_size_is_capped(monkeypatch):
+    assert compute_worker_resources(workers=1, db_connection_budget=100) == (MAX_POOL_SIZE, MAX_POOL_SIZE)
+    assert compute_worker_resources(workers=2, db_connection_budget=100) == (MAX_POOL_SIZE, MAX_POOL_SIZE)
+
+    monkeypatch.setenv("DB_POOL_SIZE", "50")
+    with pytest.raises(ValueError, match="DB_POOL_SIZE"):
+        get_pool_size()
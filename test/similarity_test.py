@@ -0,0 +1,111 @@
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+from core.similarity_index import SimilarityIndex, dhash
+from data.database_context import NullDatabaseContext
+from data.image_repository import InMemoryImageRepository
+from service.similarity_service import SimilarityService
+
+
+def make_png(shapes, size=256, brightness=0):
+    image = Image.new("RGB", (size, size), (40 + brightness, 40 + brightness, 40 + brightness))
+    draw = ImageDraw.Draw(image)
+    for box, color in shapes:
+        draw.ellipse([v * size // 256 for v in box], fill=color)
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+DUCK = [((30, 60, 200, 220), (250, 210, 0)), ((150, 30, 230, 110), (250, 210, 0))]
+BALL = [((0, 0, 120, 256), (255, 255, 255)), ((140, 100, 250, 140), (200, 0, 0))]
+
+
+# This test function checks that near-identical images have close hashes and different images do not.
+def test_dhash_distance():
+    duck = dhash(make_png(DUCK))
+    variant = dhash(make_png(DUCK, size=300, brightness=10))
+    ball = dhash(make_png(BALL))
+    assert bin(duck ^ variant).count("1") <= 6
+    assert bin(duck ^ ball).count("1") > 15
+
+
+# This test function checks the vectorized query against a brute force Hamming distance.
+def test_index_query_matches_brute_force():
+    rng = random.Random(7)
+    index = SimilarityIndex(capacity=4)
+    hashes = {f"guid{i}": rng.getrandbits(64) for i in range(5000)}
+    for guid, image_hash in hashes.items():
+        index.add(guid, image_hash)
+    query = hashes["guid42"] ^ 0b1011
+    expected = sorted(((guid, bin(h ^ query).count("1")) for guid, h in hashes.items()
+                       if bin(h ^ query).count("1") <= 20), key=lambda match: match[1])
+
+    matches = index.query(query, max_distance=20, limit=10000)
+    assert len(index) == 5000
+    assert matches[0] == ("guid42", 3)
+    assert sorted(matches) == sorted(expected)
+    assert index.query(query, max_distance=20, limit=1, exclude_guid="guid42") != [("guid42", 3)]
+
+
+# This test function checks the backfill job and the "similar to {guid}" query against the in-memory repository.
+def test_backfill_and_similar_images(tmp_path):
+    repo = InMemoryImageRepository()
+    for guid, png in (("duck", make_png(DUCK)), ("duck2", make_png(DUCK, brightness=10)), ("ball", make_png(BALL))):
+        (tmp_path / f"{guid}.png").write_bytes(png)
+        repo.create_image(guid, guid, f"{guid}.png")
+    service = SimilarityService(repo, SimilarityIndex(), db_context=NullDatabaseContext)
+    service.refresh()  # loads nothing, no image has a hash yet
+
+    stats = service.backfill(images_dir=str(tmp_path))
+    assert stats == {"hashed": 3, "missing": 0, "failed": 0}
+    similar = service.get_similar_images("duck", max_distance=10)
+    assert [image.guid for image in similar] == ["duck2"]
+    assert service.find_duplicate(dhash(make_png(DUCK)), max_distance=5) == "duck"
+
+
+# This test function checks that a running worker picks up the hashes backfilled by another process,
+# without indexing any image twice.
+def test_worker_picks_up_backfilled_hashes(tmp_path):
+    repo = InMemoryImageRepository()
+    for guid, png in (("duck", make_png(DUCK)), ("duck2", make_png(DUCK, brightness=10))):
+        (tmp_path / f"{guid}.png").write_bytes(png)
+        repo.create_image(guid, guid, f"{guid}.png")
+    worker = SimilarityService(repo, SimilarityIndex(), db_context=NullDatabaseContext, refresh_interval=0,
+                               reconcile_interval=0)
+    worker.refresh()
+    assert len(worker.index) == 0
+
+    backfill = SimilarityService(repo, SimilarityIndex(), db_context=NullDatabaseContext)
+    backfill.backfill(images_dir=str(tmp_path))
+    repo.create_image("ball", "ball", "ball.png", dhash(make_png(BALL)))
+    worker.refresh()
+    worker.refresh()
+    assert len(worker.index) == 3
+    assert [image.guid for image in worker.get_similar_images("duck", max_distance=10)] == ["duck2"]
+
+
+# This test function checks that an image that cannot be hashed is still stored, and that the warning
+# goes through the request-id aware logger.
+def test_generator_stores_unhashable_image(tmp_path, monkeypatch, caplog):
+    import base64
+    from types import SimpleNamespace
+
+    from core.image_generator import ImageGenerator
+    from core.models import ImageDetailCreate
+
+    class FakeGenerator(ImageGenerator):
+        @property
+        def client(self):
+            data = [SimpleNamespace(b64_json=base64.b64encode(b"not an image").decode())]
+            return SimpleNamespace(images=SimpleNamespace(generate=lambda **kwargs: SimpleNamespace(data=data)))
+
+    monkeypatch.chdir(tmp_path)
+    repo = InMemoryImageRepository()
+    image = FakeGenerator(repo).generate_image(ImageDetailCreate(prompt="a duck"))
+    assert repo.get_image_records_after(0, 10)[0].phash is None
+    assert image.prompt == "a duck"
+    warnings = [record for record in caplog.records if "perceptual hash" in record.getMessage()]
+    assert warnings and all(hasattr(record, "request_id") for record in warnings)
@@ -0,0 +1,135 @@
+import io
+import tarfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from core.exceptions import DataValidationError
+from data.database_context import NullDatabaseContext
+from data.image_cache import get_image_cache
+from data.image_repository import InMemoryImageRepository
+from service.transfer_service import ImageTransferService
+
+
+def make_source(tmp_path, count: int):
+    images_dir = tmp_path / "source"
+    images_dir.mkdir()
+    repo = InMemoryImageRepository()
+    for i in range(count):
+        filename = f"image_{i}.png"
+        (images_dir / filename).write_bytes(bytes([i]) * (1000 + i))
+        repo.create_image(f"prompt {i}", f"guid{i}", filename)
+    return ImageTransferService(repo, images_dir=str(images_dir), db_context=NullDatabaseContext, batch_size=2)
+
+
+def make_target(tmp_path):
+    return ImageTransferService(InMemoryImageRepository(), images_dir=str(tmp_path / "target"),
+                                db_context=NullDatabaseContext, batch_size=2, write_workers=2)
+
+
+# This test function checks that an export can be imported into an empty instance, and that running
+# the same import again is a no-op.
+def test_export_import_round_trip(tmp_path):
+    source = make_source(tmp_path, 5)
+    archive = b"".join(source.export_archive())
+    # 3 pages of metadata and checksums, 5 blobs
+    assert len(tarfile.open(fileobj=io.BytesIO(archive)).getnames()) == 3 + 3 + 5
+
+    target = make_target(tmp_path)
+    stats = target.import_archive(io.BytesIO(archive))
+    assert stats["created"] == 5
+    assert stats["blobs_written"] == 5
+    assert stats["last_id"] == 5
+    assert sorted(i.guid for i in target.image_repo.get_all_image_details()) == [f"guid{i}" for i in range(5)]
+    assert (tmp_path / "target" / "image_3.png").read_bytes() == bytes([3]) * 1003
+
+    stats = target.import_archive(io.BytesIO(archive))
+    assert stats["created"] == 0
+    assert stats["skipped"] == 5
+    assert stats["blobs_skipped"] == 5
+
+
+# This test function checks that an export can be resumed after the last ID of a page.
+def test_export_resumes_after_id(tmp_path):
+    source = make_source(tmp_path, 5)
+    archive = b"".join(source.export_archive(after_id=2))
+    names = tarfile.open(fileobj=io.BytesIO(archive)).getnames()
+    assert [name for name in names if name.startswith("images/")] == ["images/image_2.png", "images/image_3.png",
+                                                                      "images/image_4.png"]
+
+
+# This test function checks that a blob that does not match its checksum is removed again and its row is not inserted.
+def test_import_rejects_corrupt_blob(tmp_path):
+    source = make_source(tmp_path, 1)
+    archive = bytearray(b"".join(source.export_archive()))
+    archive[archive.index(bytes([0]) * 1000) + 10] = 0xFF
+
+    target = make_target(tmp_path)
+    with pytest.raises(DataValidationError):
+        target.import_archive(io.BytesIO(bytes(archive)))
+    assert target.image_repo.get_all_image_details() == []
+    assert not (tmp_path / "target" / "image_0.png").exists()
+
+
+# This test function checks that an import never overwrites a different local image of the same filename,
+# and stores the imported image under its own filename instead.
+def test_import_keeps_local_image_of_same_name(tmp_path):
+    source = make_source(tmp_path, 2)
+    archive = b"".join(source.export_archive())
+
+    target = make_target(tmp_path)
+    (tmp_path / "target").mkdir()
+    (tmp_path / "target" / "image_1.png").write_bytes(b"local")
+    target.image_repo.create_image("local prompt", "localguid", "image_1.png")
+
+    stats = target.import_archive(io.BytesIO(archive))
+    assert stats["created"] == 2
+    assert stats["blobs_renamed"] == 1
+    assert (tmp_path / "target" / "image_1.png").read_bytes() == b"local"
+    imported = target.image_repo.get_image_details_by_guid("guid1")
+    assert imported.filename == "image_1_guid1.png"
+    assert (tmp_path / "target" / imported.filename).read_bytes() == bytes([1]) * 1001
+
+    stats = target.import_archive(io.BytesIO(archive))
+    assert stats["created"] == 0
+    assert stats["blobs_skipped"] == 2
+
+
+# This test function checks that an import that fails part way reports its resume point page by page,
+# and that resuming from it completes the import and drops stale cached content.
+def test_import_checkpoints_and_resumes(tmp_path):
+    source = make_source(tmp_path, 5)
+    archive = b"".join(source.export_archive())
+    corrupt = bytearray(archive)
+    corrupt[corrupt.index(bytes([3]) * 1003) + 10] = 0xFF
+
+    target = make_target(tmp_path)
+    checkpoints = []
+    with pytest.raises(DataValidationError):
+        target.import_archive(io.BytesIO(bytes(corrupt)), checkpoint=checkpoints.append)
+    assert [checkpoint["last_id"] for checkpoint in checkpoints] == [2]
+
+    get_image_cache().put("image_4.png", b"stale", force=True)
+    stats = target.import_archive(io.BytesIO(archive), after_id=checkpoints[-1]["last_id"])
+    assert stats["created"] == 3
+    assert len(target.image_repo.get_all_image_details()) == 5
+    assert get_image_cache().get("image_4.png") is None
+
+
+# This test function checks that the export and import routes stream an archive through the app.
+def test_transfer_routes(tmp_path, monkeypatch):
+    monkeypatch.setenv("WARMUP_ON_STARTUP", "false")
+    monkeypatch.setenv("DB_CHECK_ON_STARTUP", "false")
+    from main import app
+    from web.dependencies import get_transfer_service
+
+    source = make_source(tmp_path, 3)
+    target = make_target(tmp_path)
+    with TestClient(app) as client:
+        app.dependency_overrides[get_transfer_service] = lambda: source
+        archive = client.get("/transfer/export").content
+        app.dependency_overrides[get_transfer_service] = lambda: target
+        response = client.post("/transfer/import", content=archive)
+        app.dependency_overrides.clear()
+    assert response.status_code == 200
+    assert response.json()["created"] == 3
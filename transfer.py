@@ -0,0 +1,93 @@
+# transfer.py
+"""
+This file is the command line interface for the bulk export and import of PixyProxy images and their metadata.
+
+The archive format and the resume semantics are described in service/transfer_service.py. Both commands run against
+the database configured in the .env file and the local images folder; use the /transfer routes for a remote instance.
+
+Usage:
+    python transfer.py export --output backup.tar [--after-id 0]
+    python transfer.py import backup.tar [--after-id 0] [--checkpoint-file import.checkpoint]
+    python transfer.py export --output - | ssh target "cd pixyproxy && python transfer.py import -"
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from data.image_repository import MySQLImageRepository
+from service.transfer_service import ImageTransferService
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export or import PixyProxy images and their metadata.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Stream all images to a tar archive.")
+    export_parser.add_argument("--output", default="-", help="The archive file, or - for stdout.")
+    export_parser.add_argument("--after-id", type=int, default=0, help="Resume after this ID.")
+
+    import_parser = subparsers.add_parser("import", help="Import a tar archive produced by export.")
+    import_parser.add_argument("archive", help="The archive file, or - for stdin.")
+    import_parser.add_argument("--after-id", type=int, default=None,
+                               help="Resume after this source ID (default: the checkpoint file, or 0).")
+    import_parser.add_argument("--checkpoint-file", default=None,
+                               help="Write the resume point to this file after every page, and resume from it.")
+
+    for subparser in (export_parser, import_parser):
+        subparser.add_argument("--images-dir", default="images")
+        subparser.add_argument("--batch-size", type=int, default=500)
+    import_parser.add_argument("--write-workers", type=int, default=8)
+
+    args = parser.parse_args(argv)
+    service = ImageTransferService(MySQLImageRepository(), images_dir=args.images_dir, batch_size=args.batch_size,
+                                   write_workers=getattr(args, "write_workers", 8))
+
+    if args.command == "export":
+        output = sys.stdout.buffer if args.output == "-" else open(args.output, 'wb')
+        with output:
+            for chunk in service.export_archive(args.after_id):
+                output.write(chunk)
+    else:
+        after_id = args.after_id
+        if after_id is None:
+            after_id = _read_checkpoint(args.checkpoint_file) if args.checkpoint_file else 0
+        progress = {"last_id": after_id}
+
+        def checkpoint(stats):
+            progress.update(stats)
+            if args.checkpoint_file:
+                _write_checkpoint(args.checkpoint_file, stats["last_id"])
+
+        archive = sys.stdin.buffer if args.archive == "-" else open(args.archive, 'rb')
+        try:
+            with archive:
+                stats = service.import_archive(archive, after_id, checkpoint=checkpoint)
+        except Exception as e:
+            print(json.dumps({**progress, "error": str(e)}), file=sys.stderr)
+            print(f"Import failed; resume with --after-id {progress['last_id']}", file=sys.stderr)
+            return 1
+        print(json.dumps(stats), file=sys.stderr)
+    return 0
+
+
+def _read_checkpoint(path: str) -> int:
+    if not os.path.isfile(path):
+        return 0
+    with open(path) as f:
+        return int(f.read().strip() or 0)
+
+
+def _write_checkpoint(path: str, last_id: int):
+    # Replace the file atomically, so a crash never leaves a truncated checkpoint
+    with open(path + ".part", 'w') as f:
+        f.write(f"{last_id}\n")
+    os.replace(path + ".part", path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
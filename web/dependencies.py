@@ -1,17 +1,50 @@
+import os
+from typing import Optional
 
-from fastapi import Depends
+from fastapi import Depends, Request
 
+from core.exceptions import BadRequestError
 from data.image_repository import ImageRepositoryInterface, MySQLImageRepository
+from service.generation_scheduler import INTERACTIVE, PRIORITY_CLASSES
 from service.image_service import ImageServiceInterface, ImageService
+from service.similarity_service import SimilarityService, get_similarity_index
+from service.transfer_service import ImageTransferService
 from core.image_generator import ImageGenerator
 
 def get_image_repository() -> ImageRepositoryInterface:
     return MySQLImageRepository()
 
-def get_image_generator(repo: ImageRepositoryInterface = Depends(get_image_repository)) -> ImageGenerator:
-    return ImageGenerator(repo)
+def get_similarity_service(repo: ImageRepositoryInterface = Depends(get_image_repository)) -> SimilarityService:
+    return SimilarityService(repo, get_similarity_index())
+
+def get_dedup_max_distance() -> Optional[int]:
+    # Near-duplicate generations are only deduplicated when DEDUP_MAX_DISTANCE is set
+    value = os.getenv("DEDUP_MAX_DISTANCE")
+    return int(value) if value else None
+
+def get_image_generator(repo: ImageRepositoryInterface = Depends(get_image_repository),
+                        similarity_service: SimilarityService = Depends(get_similarity_service),
+                        dedup_max_distance: Optional[int] = Depends(get_dedup_max_distance)) -> ImageGenerator:
+    return ImageGenerator(repo, similarity_service=similarity_service, dedup_max_distance=dedup_max_distance)
+
+def get_client_id(request: Request) -> str:
+    # Identify the API client by its API key or client id header, falling back to its address
+    return (request.headers.get("x-api-key") or request.headers.get("x-client-id")
+            or (request.client.host if request.client else "unknown"))
+
+def get_priority(request: Request) -> str:
+    # Generations are interactive unless the client marks them as batch work
+    priority = request.headers.get("x-priority", INTERACTIVE).lower()
+    if priority not in PRIORITY_CLASSES:
+        raise BadRequestError(f"Invalid x-priority header, expected one of {', '.join(PRIORITY_CLASSES)}.")
+    return priority
 
 def get_image_service(repo: ImageRepositoryInterface = Depends(get_image_repository), 
-                      generator: ImageGenerator = Depends(get_image_generator)) -> ImageServiceInterface:
-    return ImageService(repo, generator)
+                      generator: ImageGenerator = Depends(get_image_generator),
+                      client_id: str = Depends(get_client_id)) -> ImageServiceInterface:
+    return ImageService(repo, generator, client_id=client_id,
+                        similarity_service=generator.similarity_service if generator.dedup_max_distance is not None else None)
+
+def get_transfer_service(repo: ImageRepositoryInterface = Depends(get_image_repository)) -> ImageTransferService:
+    return ImageTransferService(repo)
 
@@ -0,0 +1,46 @@
+# web/event_stream.py
+"""
+This file streams the progress events of a generation to a client as Server-Sent Events.
+
+The stream is an async generator on the event loop: a client waiting for the next event holds no thread and no
+database connection. A comment line is sent every `heartbeat` seconds without events, so proxies keep the connection
+open and a client that went away is noticed. The stream ends after the done or error event.
+
+Author: djjay
+Date: 2024-03-30
+"""
+import os
+from fastapi.responses import StreamingResponse
+from service.generation_progress import GenerationProgress, GenerationRun, Subscription, TERMINAL_EVENTS
+
+HEARTBEAT = b": heartbeat\n\n"
+
+
+def get_heartbeat_interval() -> float:
+    return float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+
+
+async def _events(progress: GenerationProgress, run: GenerationRun, subscription: Subscription, heartbeat: float):
+    try:
+        while True:
+            event = await subscription.next(timeout=heartbeat)
+            if event is None:
+                yield HEARTBEAT
+                continue
+            yield event.encode()
+            if event.name in TERMINAL_EVENTS:
+                return
+    finally:
+        progress.unsubscribe(run, subscription)
+
+
+def event_stream_response(progress: GenerationProgress, run: GenerationRun, heartbeat: float) -> StreamingResponse:
+    """
+    Creates the Server-Sent Events response streaming the events of a generation.
+
+    The subscription is made right away, before the route returns: the body of the stream only starts running once
+    the response headers are sent, and events published until then would otherwise be missed.
+    """
+    subscription = progress.subscribe(run)
+    return StreamingResponse(_events(progress, run, subscription, heartbeat), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -2,12 +2,16 @@ import hashlib
 import logging
 import socket
 import threading
+import time
 from datetime import datetime
+from typing import Callable, Optional
 
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from data.replica_router import WriteSession, write_session
 from service import set_request_id, get_request_id
+from web.request_capture import RequestCapture
 
 
 class RequestIdMiddleware(BaseHTTPMiddleware):
@@ -39,19 +43,41 @@ def _hashify(request_id):
 
 
 class LoggingMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
+    def __init__(self, app, capture: Optional[RequestCapture] = None,
+                 capture_factory: Optional[Callable[[], Optional[RequestCapture]]] = None):
         super().__init__(app)
         self.app = app
         self.logger = logging.getLogger(__name__)
+        self.capture = capture
+        self._capture_factory = capture_factory
 
     async def dispatch(self, request: Request, call_next):
+        if self._capture_factory is not None:
+            # Created on the first request rather than at import, once the configuration can be loaded
+            self.capture, self._capture_factory = self._capture_factory(), None
         self.log_start(request)
         current_time = datetime.now()
+        captured = self.capture is not None and self.capture.should_capture()
+        started = time.time()
         response: Response = await call_next(request)
         duration = datetime.now() - current_time
         self.log_end(duration, request, response)
+        if captured:
+            self.capture_request(request, response, started, duration.total_seconds() * 1000.0)
         return response
 
+    def capture_request(self, request: Request, response: Response, started: float, duration_ms: float):
+        route = request.scope.get("route")
+        content_length = response.headers.get("content-length")
+        self.capture.record(method=request.method,
+                            route=getattr(route, "path", None),
+                            path=request.url.path,
+                            guid=request.path_params.get("guid"),
+                            started=started,
+                            status=response.status_code,
+                            response_bytes=int(content_length) if content_length is not None else None,
+                            duration_ms=duration_ms)
+
     @staticmethod
     def log_start(request: Request):
         request_id = get_request_id()
@@ -75,3 +101,36 @@ class LoggingMiddleware(BaseHTTPMiddleware):
                       + f"[{thread_id}] REQUEST END: {request_method} {request_uri} "
                       + f"response=\"{status_code}\" duration=\"{duration}ms\"")
         print(log_string)
+
+
+class ReadYourWritesMiddleware(BaseHTTPMiddleware):
+    """
+    Carries the time of a client's last write between its requests, so that read-your-writes holds across
+    worker processes (see data/replica_router.py). The time is returned in a cookie and an X-Last-Write header
+    after every write. The client sends it back with either of them.
+    """
+    COOKIE = "pixyproxy_last_write"
+    HEADER = "x-last-write"
+
+    async def dispatch(self, request: Request, call_next):
+        session = WriteSession(_parse_timestamp(request.headers.get(self.HEADER) or request.cookies.get(self.COOKIE)))
+        # The session object is shared with the tasks and threads that serve the request
+        token = write_session.set(session)
+        try:
+            response: Response = await call_next(request)
+        finally:
+            write_session.reset(token)
+        if session.wrote:
+            value = f"{session.last_write:.3f}"
+            response.headers[self.HEADER] = value
+            response.set_cookie(self.COOKIE, value, max_age=max(1, int(session.sticky_seconds + 1)),
+                                httponly=True, samesite="lax")
+        return response
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[float]:
+    try:
+        # A time in the future would make the reads of the client stick to the primary for longer
+        return min(float(value), time.time()) if value else None
+    except ValueError:
+        return None
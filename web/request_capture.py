@@ -0,0 +1,100 @@
+# web/request_capture.py
+"""
+This module implements the request capture of the PixyProxy system.
+
+When enabled, the LoggingMiddleware appends one JSONL record per sampled request to a capture file. A record holds the
+method, the route template, the path, the image GUID, the wall clock timestamp and the offset from the start of the
+capture, the status code, the response size and the duration. The capture can be replayed against an instance with
+bench/replay.py.
+
+Capture is configured with environment variables:
+- CAPTURE_FILE: the JSONL file to append to; capture is disabled when unset. `{pid}` is replaced with the process id,
+  so every worker can write its own file.
+- CAPTURE_SAMPLE_RATE: the fraction of requests to record (default 1.0).
+- CAPTURE_ANONYMIZE: when true, GUIDs are replaced by a salted hash and paths are rebuilt from the route template.
+- CAPTURE_SALT: the salt of the GUID hash (default random per process).
+
+Author: djjay
+Date: 2024-03-30
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+
+class RequestCapture:
+    def __init__(self, path: str, sample_rate: float = 1.0, anonymize: bool = False, salt: str = None):
+        self.path = path.replace('{pid}', str(os.getpid()))
+        self.sample_rate = sample_rate
+        self.anonymize = anonymize
+        self.salt = salt if salt is not None else os.urandom(8).hex()
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a', buffering=1)
+
+    @classmethod
+    def from_env(cls) -> Optional['RequestCapture']:
+        """
+        Creates the request capture from the environment, including the .env file.
+
+        Returns:
+        Optional[RequestCapture]: The request capture, or None when CAPTURE_FILE is not set.
+        """
+        from data import get_config
+
+        get_config()  # Loads the .env file
+        path = os.getenv('CAPTURE_FILE')
+        if not path:
+            return None
+        return cls(path,
+                   sample_rate=float(os.getenv('CAPTURE_SAMPLE_RATE', 1.0)),
+                   anonymize=os.getenv('CAPTURE_ANONYMIZE', 'false').lower() in ('1', 'true', 'yes'),
+                   salt=os.getenv('CAPTURE_SALT'))
+
+    def should_capture(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def anonymize_guid(self, guid: str) -> str:
+        return hashlib.sha256(f"{self.salt}{guid}".encode()).hexdigest()[:32]
+
+    def record(self, method: str, route: Optional[str], path: str, guid: Optional[str], started: float,
+               status: int, response_bytes: Optional[int], duration_ms: float):
+        """
+        Appends the record of a request to the capture file.
+
+        Parameters:
+        method (str): The HTTP method.
+        route (Optional[str]): The route template, e.g. /image/{guid}, or None if no route matched.
+        path (str): The request path.
+        guid (Optional[str]): The image GUID of the request, if any.
+        started (float): The wall clock time the request started at.
+        status (int): The response status code.
+        response_bytes (Optional[int]): The size of the response body, if known.
+        duration_ms (float): The duration of the request in ms.
+        """
+        if guid is not None and self.anonymize:
+            guid = self.anonymize_guid(guid)
+            path = route.replace('{guid}', guid) if route else path
+        entry = {
+            "ts": round(started, 3),
+            "offset_ms": round((started - self.started) * 1000.0, 3),
+            "method": method,
+            "route": route,
+            "path": path,
+            "guid": guid,
+            "status": status,
+            "response_bytes": response_bytes,
+            "duration_ms": round(duration_ms, 3),
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -6,18 +6,44 @@ Author: djjay
 Date: 2024-03-20
 """
 from typing import List
-from fastapi import APIRouter, Depends
-from core.models import ImageDetailCreate, ImageDetail
+from fastapi import APIRouter, Depends, Query
+from core.exceptions import RecordNotFoundError
+from core.models import ImageDetailCreate, ImageDetail, SimilarImage
+from service.generation_progress import GenerationProgress, get_generation_progress
 from service.image_service import ImageServiceInterface
-from web.dependencies import get_image_service
+from service.similarity_service import SimilarityService
+from web.dependencies import get_client_id, get_image_service, get_priority, get_similarity_service
+from web.event_stream import event_stream_response, get_heartbeat_interval
 
 router = APIRouter()
 
-# Route to create a new image
+# Route to create a new image. The generation waits for its turn on the event loop and only then takes a thread.
 @router.post("/", response_model=ImageDetail)
-def create_image(image_detail: ImageDetailCreate, 
-                 service: ImageServiceInterface = Depends(get_image_service)):
-    return service.create_image(image_detail)
+async def create_image(image_detail: ImageDetailCreate,
+                       service: ImageServiceInterface = Depends(get_image_service),
+                       progress: GenerationProgress = Depends(get_generation_progress),
+                       client_id: str = Depends(get_client_id), priority: str = Depends(get_priority)):
+    return await progress.generate(image_detail, service, client_id, priority)
+
+# Route to create a new image and stream its progress as Server-Sent Events. The headers are sent before the image
+# is stored, so the done event carries the X-Last-Write value to send with reads of the image.
+@router.post("/stream")
+async def create_image_stream(image_detail: ImageDetailCreate,
+                              service: ImageServiceInterface = Depends(get_image_service),
+                              progress: GenerationProgress = Depends(get_generation_progress),
+                              client_id: str = Depends(get_client_id), priority: str = Depends(get_priority),
+                              heartbeat: float = Depends(get_heartbeat_interval)):
+    run = progress.start(image_detail, service, client_id, priority)
+    return event_stream_response(progress, run, heartbeat)
+
+# Route to stream the progress of the latest generation in progress of a prompt as Server-Sent Events
+@router.get("/stream")
+async def get_image_stream(prompt: str, progress: GenerationProgress = Depends(get_generation_progress),
+                           heartbeat: float = Depends(get_heartbeat_interval)):
+    run = progress.get_run(prompt)
+    if run is None:
+        raise RecordNotFoundError()
+    return event_stream_response(progress, run, heartbeat)
 
 # Route to get the details of an image by its GUID
 @router.get("/{guid}", response_model=ImageDetail)
@@ -33,4 +59,10 @@ def get_all_image_details(service: ImageServiceInterface = Depends(get_image_ser
 # Route to get the content of an image by its GUID
 @router.get("/{guid}/content")
 def get_image_content(guid: str, service: ImageServiceInterface = Depends(get_image_service)):
-    return service.get_image_content(guid)
\ No newline at end of file
+    return service.get_image_content(guid)
+
+# Route to get the near-duplicates of an image by its GUID
+@router.get("/{guid}/similar", response_model=List[SimilarImage])
+def get_similar_images(guid: str, max_distance: int = Query(10, ge=0, le=64), limit: int = Query(20, ge=1, le=1000),
+                       service: SimilarityService = Depends(get_similarity_service)):
+    return service.get_similar_images(guid, max_distance, limit)
\ No newline at end of file
@@ -0,0 +1,34 @@
+# web/routers/metrics_router.py
+"""
+This file defines the routes for the metrics of the PixyProxy system. The metrics are per worker process.
+
+Author: djjay
+Date: 2024-03-30
+"""
+from typing import Dict, Optional
+from fastapi import APIRouter, Depends
+from data import get_replica_router
+from data.image_cache import ImageContentCache, get_image_cache
+from service.generation_progress import GenerationProgress, get_generation_progress
+from service.generation_scheduler import GenerationScheduler, get_generation_scheduler
+
+router = APIRouter()
+
+# The first call may open the replica pools and check them, so this dependency is sync and runs on the threadpool
+def get_replica_stats() -> Optional[Dict]:
+    router = get_replica_router()
+    return router.stats() if router is not None else None
+
+# Route to get the metrics of this worker process. The stats of the generation scheduler are read on the event loop,
+# which owns them; everything that may block is resolved by the dependencies first.
+@router.get("/")
+async def get_metrics(replicas: Optional[Dict] = Depends(get_replica_stats),
+                      scheduler: GenerationScheduler = Depends(get_generation_scheduler),
+                      progress: GenerationProgress = Depends(get_generation_progress),
+                      image_cache: ImageContentCache = Depends(get_image_cache)):
+    return {
+        "image_cache": image_cache.stats(),
+        "replicas": replicas,
+        "generation": scheduler.stats(),
+        "generation_progress": progress.stats(),
+    }
@@ -0,0 +1,62 @@
+# web/routers/transfer_router.py
+"""
+This file defines the routes for the bulk export and import of images and their metadata.
+
+Both routes stream: the export is generated page by page while the client reads it, and the import reads the request
+body as it arrives, so neither holds the archive in memory.
+
+Author: djjay
+Date: 2024-03-30
+"""
+import io
+from anyio import from_thread, to_thread
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+from service.transfer_service import ImageTransferService
+from web.dependencies import get_transfer_service
+
+router = APIRouter()
+
+
+class RequestStreamReader(io.RawIOBase):
+    """
+    A blocking file object over the body of a request, for use from a worker thread.
+    """
+
+    def __init__(self, request: Request):
+        self._chunks = request.stream()
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    async def _next_chunk(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            chunk = from_thread.run(self._next_chunk)
+            if chunk is None:
+                return 0
+            self._buffer = chunk
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+# Route to export all images after an ID as a tar stream
+@router.get("/export")
+def export_images(after_id: int = 0, service: ImageTransferService = Depends(get_transfer_service)):
+    return StreamingResponse(service.export_archive(after_id), media_type="application/x-tar",
+                             headers={"Content-Disposition": 'attachment; filename="pixyproxy-export.tar"'})
+
+# Route to import a tar stream produced by the export route
+@router.post("/import")
+async def import_images(request: Request, after_id: int = 0,
+                        service: ImageTransferService = Depends(get_transfer_service)):
+    stream = io.BufferedReader(RequestStreamReader(request), buffer_size=1024 * 1024)
+    return await to_thread.run_sync(service.import_archive, stream, after_id)